@@ -1,6 +1,6 @@
 from optparse import OptionParser
 
-SOFTWARE_NAME = 'iClicker'
+from consts import SOFTWARE_NAME
 
 
 def main():
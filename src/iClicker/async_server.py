@@ -0,0 +1,275 @@
+"""
+An engine for the main server that serves all of its connections from a single event loop over non-blocking sockets,
+rather than a thread per connection. The handlers are the same ones, they run on a few worker threads since some of them
+wait for the clicker.
+
+Selected with ``run_server(engine=ENGINE_ASYNC)``.
+"""
+import asyncore
+import errno
+import select
+import socket
+import traceback
+from collections import deque
+from Queue import Queue
+from threading import Thread, Event, Lock
+
+from consts import *
+from protocol import MessageReader, negotiate_codec
+from server import MainServer, MainServerHandler, WakeUpSocket
+from settings import ServerSettingsSnapshot
+
+
+class AsyncMainServerHandler(MainServerHandler):
+    """
+    The handlers of a single connection of the event loop.
+
+    Instead of reading from its socket, it's fed the messages as they arrive, and it writes through the event loop.
+    """
+    # Events aren't streamed to a session that has this many bytes waiting to be sent.
+    MAX_PENDING_OUTPUT = 1024 * 1024
+
+    def __init__(self, connection, client_address, server):
+        self.server = server  # type: AsyncMainServer
+        self.client_address = client_address
+        self.request = connection.socket
+        self._connection = connection  # type: Connection
+        self._password = None
+        self._expected_response = None
+        self._first_request = None
+        self._on_message = self._on_first_message
+        self._setup_protocol()
+
+    def _write(self, data):
+        self.server.call_soon(self._connection.write, data)
+
+    def post_event(self, code, kwargs):
+        if self._connection.pending_output() > self.MAX_PENDING_OUTPUT:
+            raise socket.timeout("{} isn't reading its session".format(self.client_address[0]))
+        self._post(code, **kwargs)
+
+    def feed(self, data):
+        """Handle a message that arrived on the connection. Called on the event loop's thread."""
+        self._on_message(data['code'], data)
+
+    def _on_first_message(self, code, data):
+        self._codec = negotiate_codec(data.get('codecs'))
+        self._password = ServerSettingsSnapshot.current().server_password
+        self._first_request = (code, data)
+        if self._has_valid_token(code, data, self._password):
+            self._authenticated()
+        else:
+            self._expected_response = self._start_challenge(self._password)
+            self._on_message = self._on_challenge_response
+
+    def _on_challenge_response(self, code, data):
+        if code != CODE_CHALLENGE_RESPONSE or data.get('response') != self._expected_response:
+            self._post(CODE_CHALLENGE_FAILED)
+            self._on_message = self._ignore
+            self.server.call_soon(self._connection.close_when_done)
+            return
+        self._challenge_succeeded(self._password)
+        self._authenticated()
+
+    def _authenticated(self):
+        code, data = self._first_request
+        self._first_request = None
+        if code == CODE_OPEN_SESSION:
+            self.is_session = True
+            self._on_message = self._on_session_request
+        else:
+            self._on_message = self._ignore
+            self.server.executor.submit(self._respond, code, data)
+
+    def _respond(self, code, data):
+        try:
+            self._post(CODE_SERVER_RESPONSE, **self._call_handler(code, data))
+        finally:
+            self.server.call_soon(self._connection.close_when_done)
+
+    def _on_session_request(self, code, data):
+        self.server.executor.submit(self._handle_session_request, data)
+
+    def _ignore(self, code, data):
+        pass
+
+
+class Connection(asyncore.dispatcher):
+    def __init__(self, sock, client_address, server, socket_map):
+        asyncore.dispatcher.__init__(self, sock, socket_map)
+        self._reader = MessageReader(sock)
+        self._output = bytearray()
+        self._is_closing = False
+        self._is_closed = False
+        self.handler = AsyncMainServerHandler(self, client_address, server)
+
+    def readable(self):
+        return not self._is_closing
+
+    def writable(self):
+        return bool(self._output)
+
+    def pending_output(self):
+        return len(self._output)
+
+    def handle_read(self):
+        try:
+            received = self._reader.fill()
+        except socket.error as error:
+            if error.errno in (errno.EWOULDBLOCK, errno.EAGAIN):
+                return
+            self.handle_close()
+            return
+        if not received:
+            self.handle_close()
+            return
+        for data in iter(self._reader.read_buffered, None):
+            self.handler.feed(data)
+
+    def write(self, data):
+        if not self._is_closed:
+            self._output.extend(data)
+
+    def handle_write(self):
+        sent = self.send(self._output)
+        del self._output[:sent]
+        if self._is_closing and not self._output:
+            self.handle_close()
+
+    def close_when_done(self):
+        """Close the connection once everything written to it was sent."""
+        self._is_closing = True
+        if not self._output:
+            self.handle_close()
+
+    def handle_close(self):
+        if self._is_closed:
+            return
+        self._is_closed = True
+        self.handler.server.unsubscribe(self.handler)
+        self.close()
+
+    def handle_error(self):
+        traceback.print_exc()
+        self.handle_close()
+
+
+class Listener(asyncore.dispatcher):
+    def __init__(self, server, socket_map):
+        asyncore.dispatcher.__init__(self, server.socket, socket_map)
+        # The socket is already listening, it was set up by the TCPServer.
+        self.accepting = True
+        self.server = server  # type: AsyncMainServer
+
+    def writable(self):
+        return False
+
+    def handle_accept(self):
+        pair = self.accept()
+        if pair is not None:
+            Connection(pair[0], pair[1], self.server, self._map)
+
+
+class Waker(asyncore.dispatcher):
+    """Wakes the event loop up to run callbacks scheduled from other threads."""
+    def __init__(self, socket_map):
+        self._wake_up_socket = WakeUpSocket()
+        asyncore.dispatcher.__init__(self, self._wake_up_socket.reader, socket_map)
+        self._callbacks = deque()
+        self._lock = Lock()
+
+    def call_soon(self, callback, *args):
+        with self._lock:
+            self._callbacks.append((callback, args))
+            is_first = len(self._callbacks) == 1
+        if is_first:
+            self.wake()
+
+    def wake(self):
+        self._wake_up_socket.wake()
+
+    def writable(self):
+        return False
+
+    def handle_read(self):
+        self._wake_up_socket.clear()
+        with self._lock:
+            callbacks, self._callbacks = self._callbacks, deque()
+        for callback, args in callbacks:
+            try:
+                callback(*args)
+            except Exception:
+                traceback.print_exc()
+
+    def close(self):
+        asyncore.dispatcher.close(self)
+        self._wake_up_socket.close()
+
+
+class Executor(object):
+    """A fixed pool of threads running jobs in the order they were submitted."""
+    def __init__(self, workers):
+        self._jobs = Queue()
+        self._threads = [Thread(target=self._run, name='Async server worker #{}'.format(index))
+                         for index in xrange(workers)]
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+
+    def submit(self, method, *args):
+        self._jobs.put((method, args))
+
+    def _run(self):
+        for method, args in iter(self._jobs.get, None):
+            try:
+                method(*args)
+            except Exception:
+                traceback.print_exc()
+
+    def stop(self):
+        for _ in self._threads:
+            self._jobs.put(None)
+
+
+class AsyncMainServer(MainServer):
+    """
+    The main server, with all of its connections served by a single event loop (``serve_forever``) and the handlers
+    running on ``ASYNC_WORKERS`` threads. The clicker itself is still used through its own worker.
+    """
+    def __init__(self, server_name, server_address):
+        MainServer.__init__(self, server_name, server_address)
+        self._socket_map = {}
+        self._waker = Waker(self._socket_map)
+        self.executor = Executor(ASYNC_WORKERS)
+        self._stop_event = Event()
+        self._is_shut_down = Event()
+        self._is_shut_down.set()
+
+    def call_soon(self, callback, *args):
+        """Run the callback on the event loop's thread."""
+        self._waker.call_soon(callback, *args)
+
+    def serve_forever(self, poll_interval=0.5):
+        self._stop_event.clear()
+        self._is_shut_down.clear()
+        listener = Listener(self, self._socket_map)
+        try:
+            while not self._stop_event.is_set():
+                asyncore.loop(poll_interval, hasattr(select, 'poll'), self._socket_map, count=1)
+        finally:
+            # The listening socket is closed by server_close.
+            listener.del_channel()
+            for dispatcher in self._socket_map.values():
+                if dispatcher is not self._waker:
+                    dispatcher.handle_close()
+            self._is_shut_down.set()
+
+    def shutdown(self):
+        self._stop_event.set()
+        self._waker.wake()
+        self._is_shut_down.wait()
+
+    def server_close(self):
+        MainServer.server_close(self)
+        self.executor.stop()
+        self._waker.close()
@@ -1,10 +1,16 @@
 import hashlib
 import hmac
+import errno
 import json
 import time
+import traceback
+from itertools import count
 from socket import *
+from threading import Lock, Thread
 
 from consts import *
+from futures import Future, TimeoutError
+from protocol import MessageReader, send_message, send_messages, SUPPORTED_CODECS, CODEC_JSON
 from server import BaseServerHandler, _init_server, Server
 from settings import ClientSettings
 
@@ -52,72 +58,265 @@ class BadPasswordException(Exception):
         return "Bad Password for {}{}:{}".format(server_name, self.server_ip, self.server_port)
 
 
+class RequestFailedException(Exception):
+    pass
+
+
+class ServerBusyException(error):
+    pass
+
+
 class Client(object):
+    """
+    Talks to a server.
+
+    By default every request is sent over a new connection, which goes through the challenge on its own. After
+    ``open_session``, all the requests share a single authenticated connection instead and may be answered out of
+    order. A session may also ``subscribe`` to the server's events, which are then streamed down the same connection
+    and passed to ``event_handlers`` (by code), so there's no need for a notifications listener the server connects to.
+    """
     def __init__(self, server_address=None, port=None, password=None, client_name=None, is_password_hashed=False,
-                 notifications_server_port=None):
+                 notifications_server_port=None, timeout=None):
         client_settings = ClientSettings()
         self.server_address = server_address or client_settings.connected_server[1]
         self.server_name = self.server_address
         self.port = port or client_settings.connected_server[2]
         self.socket = None
+        self._reader = None  # type: MessageReader
+        self._codec = CODEC_JSON
         self.client_name = client_name or client_settings.client_name
         if password:
             self.password = password if is_password_hashed else hashlib.sha1(password).hexdigest()
         else:
             self.password = client_settings.server_password
         self.notifications_server_port = notifications_server_port
+        self.timeout = timeout
+        self.event_handlers = {}  # type: dict[int, types.FunctionType]
+        self._session_socket = None
+        self._session_codec = CODEC_JSON
+        self._session_lock = Lock()
+        self._pending_requests = {}  # type: dict[int, Future]
+        self._request_ids = count(1)
+        self._token = None
+        self._token_expiry = 0
+        self._received_messages = []
 
     def _connect(self):
         self.socket = socket(AF_INET, SOCK_STREAM)
+        self.socket.settimeout(self.timeout)
         self.socket.connect((self.server_address, self.port))
+        self._reader = MessageReader(self.socket)
+        # Until the server picks one of the offered codecs.
+        self._codec = CODEC_JSON
+        # Whatever was received on the previous connection isn't an answer to anything on this one.
+        self._received_messages = []
 
     def _send(self, code, **kwargs):
         self._connect()
         kwargs['code'] = code
         kwargs['name'] = self.client_name
-        self.socket.send(json.dumps(kwargs))
+        kwargs['codecs'] = SUPPORTED_CODECS
+        # Sessions go through the challenge, it's only once per session anyway. Leave a margin, so the token doesn't
+        # expire on its way to the server.
+        if code != CODE_OPEN_SESSION and self._token and time.time() < self._token_expiry - 5:
+            kwargs['token'] = self._token
+        send_message(self.socket, kwargs)
         self._challenge()
 
     def connect(self):
+        if not self.is_session_open():
+            self.open_session()
+            if self.event_handlers:
+                self.subscribe()
         self.send(CODE_START_COMM, notifications_server_port=self.notifications_server_port)
         return self.send_receive(CODE_GET_SERVER_INFO)[1]
 
     def send(self, code, **kwargs):
+        if self.is_session_open():
+            self._session_result(self.request(code, **kwargs))
+            return
         self._send(code, **kwargs)
+        # The response isn't waited for, but it may have come already (instead of the challenge).
+        self._received_messages = []
         self.close()
 
     def send_receive(self, code, **kwargs):
+        if self.is_session_open():
+            return self._session_result(self.request(code, **kwargs))
         self._send(code, **kwargs)
         val = self.receive()
         self.close()
+        if val[1] is not None and 'error' in val[1]:
+            # As a session's request fails.
+            raise RequestFailedException(val[1]['error'])
         return val
 
-    def receive(self):
-        data = self.socket.recv(1024)
-        if data:
-            try:
-                data = json.loads(data)
+    def _session_result(self, future):
+        """
+        Wait for the response to a session request, for up to the client's timeout (or ``SESSION_REQUEST_TIMEOUT``).
+
+        A session that doesn't answer in time is assumed dead (e.g. the server went away without closing it) and is
+        closed, so the next request opens a new one.
+        """
+        seconds = self.timeout or SESSION_REQUEST_TIMEOUT
+        try:
+            return future.result(seconds)
+        except TimeoutError:
+            self.close_session()
+            raise timeout("{} didn't answer within {} seconds".format(self.server_name, seconds))
+
+    def is_session_open(self):
+        return self._session_socket is not None
+
+    def open_session(self):
+        """Open the connection that all the following requests will share, until it's closed."""
+        self._send(CODE_OPEN_SESSION)
+        session_socket, self.socket = self.socket, None
+        # A session is expected to sit idle between requests, so the requests are timed instead (see _session_result).
+        session_socket.settimeout(None)
+        self._session_codec = self._codec
+        self._session_socket = session_socket
+        reader = Thread(target=self._read_session, args=(session_socket, self._reader),
+                        name='Session with {}'.format(self.server_name))
+        reader.daemon = True
+        reader.start()
+
+    def _read_session(self, session_socket, reader):
+        """
+        :type reader: MessageReader
+        """
+        try:
+            for data in iter(reader.read, None):
                 if 'name' in data:
                     self.server_name = data['name']
-                return data['code'], data
-            except:
-                print data
+                if 'request_id' not in data:
+                    self._handle_event(data)
+                    continue
+                with self._session_lock:
+                    future = self._pending_requests.pop(data.get('request_id'), None)
+                if future is None:
+                    continue
+                if 'error' in data:
+                    future.set_exception((RequestFailedException, RequestFailedException(data['error']), None))
+                else:
+                    future.set_result((data['code'], data))
+        except error:
+            pass
+        finally:
+            with self._session_lock:
+                if self._session_socket is session_socket:
+                    self._session_socket = None
+                pending_requests, self._pending_requests = self._pending_requests, {}
+            session_socket.close()
+            closed_error = error(errno.ECONNRESET, 'The session with {} was closed'.format(self.server_name))
+            for future in pending_requests.values():
+                future.set_exception((error, closed_error, None))
+
+    def _handle_event(self, data):
+        if data['code'] == CODE_EVENTS_BATCH:
+            for event in data['events']:
+                self._handle_event(event)
+            return
+        handler = self.event_handlers.get(data['code'])
+        if handler is None:
+            return
+        try:
+            handler(**data)
+        except Exception:
+            traceback.print_exc()
+
+    def subscribe(self, handlers=None):
+        """
+        Have the server stream its events down the session (which must be open), for as long as it's open.
+
+        The handlers are called on the session's thread, so they should return quickly.
+        """
+        if handlers is not None:
+            self.event_handlers = handlers
+        self.send(CODE_SUBSCRIBE)
+
+    def request(self, code, **kwargs):
+        """
+        Send a request over the session without waiting for its response.
+
+        :return: A future of the (code, data) response.
+        :rtype: Future
+        """
+        kwargs['code'] = code
+        return self.pipeline(kwargs)[0]
+
+    def pipeline(self, *requests):
+        """
+        Send several requests over the session back to back, in a single write, without waiting for their responses.
+
+        Each request is a dict of the request's arguments, including its ``code``.
+
+        :return: A future of the (code, data) response of each request.
+        :rtype: list[Future]
+        """
+        futures = []
+        messages = []
+        with self._session_lock:
+            if self._session_socket is None:
+                raise error(errno.ENOTCONN, 'There is no open session with {}'.format(self.server_name))
+            for request in requests:
+                request_id = next(self._request_ids)
+                messages.append(dict(request, name=self.client_name, request_id=request_id))
+                futures.append(Future())
+                self._pending_requests[request_id] = futures[-1]
+            try:
+                send_messages(self._session_socket, messages, self._session_codec)
+            except error:
+                for message in messages:
+                    self._pending_requests.pop(message['request_id'])
                 raise
+        return futures
+
+    def close_session(self):
+        with self._session_lock:
+            session_socket, self._session_socket = self._session_socket, None
+        if session_socket is not None:
+            try:
+                session_socket.shutdown(SHUT_RDWR)
+            except error:
+                pass
+            session_socket.close()
+
+    def receive(self):
+        if self._received_messages:
+            return self._received_messages.pop(0)
+        data = self._reader.read()
+        if data:
+            if 'name' in data:
+                self.server_name = data['name']
+            if 'codec' in data:
+                self._codec = data['codec']
+            return data['code'], data
         else:
             return None, None
 
     def _challenge(self):
         code, data = self.receive()
+        if code == CODE_SERVER_BUSY:
+            raise ServerBusyException(errno.EBUSY, '{} is too busy, try again later'.format(self.server_name))
+        if code not in (CODE_CHALLENGE_NOT_REQUIRED, CODE_CHALLENGE_START):
+            # The token was accepted, so this is already the response to the request.
+            self._received_messages.insert(0, (code, data))
+            return None
         if code is CODE_CHALLENGE_NOT_REQUIRED:
             response = None
         else:
-            assert code is CODE_CHALLENGE_START, code
             challenge = data['challenge']
             password = hashlib.sha1(self.password or '').hexdigest()
             response = hmac.new(str(challenge), str(password), hashlib.sha1).hexdigest()
-        self.socket.send(json.dumps(dict(code=CODE_CHALLENGE_RESPONSE, response=response)))
-        if self.receive()[0] != CODE_CHALLENGE_SUCCESS:
+        send_message(self.socket, dict(code=CODE_CHALLENGE_RESPONSE, response=response), self._codec)
+        result_code, result = self.receive()
+        if result_code != CODE_CHALLENGE_SUCCESS:
+            self._token = None
             raise BadPasswordException(data['name'], self.server_address, self.port)
+        if result.get('token'):
+            self._token = result['token']
+            self._token_expiry = time.time() + result['token_timeout']
         return response
 
     def server_info(self):
@@ -132,8 +331,35 @@ class Client(object):
     def set_auto_clicker(self, interval):
         self.send_receive(CODE_SET_AUTO_CLICKER, interval=interval)
 
+    def set_auto_click_schedule(self, interval=None, cron=None, enabled=True, schedule_id=None):
+        """
+        Add an auto clicker schedule, or replace the one with the given ID. The server's schedules are in its info.
+
+        :param interval: Click every this many minutes.
+        :param cron: Or click whenever this crontab rule ("minute hour day-of-month month day-of-week") matches.
+        :return: The schedule, with its ID.
+        :rtype: dict
+        :raise RequestFailedException: If the server turned the schedule down, e.g. for a bad cron rule.
+        """
+        schedule = dict(id=schedule_id, interval=interval, cron=cron, enabled=enabled)
+        return self.send_receive(CODE_SET_AUTO_CLICK_SCHEDULE, schedule=schedule)[1]['schedule']
+
+    def remove_auto_click_schedule(self, schedule_id):
+        self.send_receive(CODE_REMOVE_AUTO_CLICK_SCHEDULE, schedule_id=schedule_id)
+
+    def temperature_history(self, start=None, end=None, buckets=100):
+        """
+        :return: A [bucket start time, minimum, average, maximum, samples count] list for each bucket with samples.
+        """
+        return self.send_receive(CODE_GET_TEMPERATURE_HISTORY, start=start, end=end, buckets=buckets)[1]['history']
+
+    def clicker_stats(self, reset=False):
+        return self.send_receive(CODE_GET_CLICKER_STATS, reset=reset)[1]['stats']
+
     def close(self):
-        self.socket.close()
+        if self.socket:
+            self.socket.close()
+        self.close_session()
 
 
 def run_client_notifications_receiver(threaded=True, handlers=None):
@@ -1,6 +1,7 @@
 from itertools import count as _count
 
 # General settings
+SOFTWARE_NAME = 'iClicker'
 SERVER_MODE = 'Server'
 CLIENT_MODE = 'Client'
 
@@ -32,15 +33,49 @@ CODE_SET_AUTO_CLICKER = _next()
 CODE_SHOW_NOTIFICATION = _next()
 CODE_CLICK_HAPPENED = _next()
 CODE_AUTO_CLICKER_CHANGED = _next()
+CODE_EVENTS_BATCH = _next()
+# Diagnostics codes
+CODE_GET_CLICKER_STATS = _next()
+# History codes
+CODE_GET_TEMPERATURE_HISTORY = _next()
+# Session codes
+CODE_OPEN_SESSION = _next()
+CODE_SUBSCRIBE = _next()
+# Admission control codes
+CODE_SERVER_BUSY = _next()
+# Auto click schedules codes
+CODE_SET_AUTO_CLICK_SCHEDULE = _next()
+CODE_REMOVE_AUTO_CLICK_SCHEDULE = _next()
 
 # Server Settings
 FIND_SERVER_TIMEOUT = 5  # 5 Seconds
+SETTINGS_WATCH_INTERVAL = 1  # Seconds between checks whether the settings file changed
+SETTINGS_FLUSH_DELAY = 0.5   # Seconds a write waits for more writes, to save them all together
 SESSION_TIMEOUT = 20     # 20 Seconds
-
-
-def split_json_data(json_data):
-    import re
-    return ['{%s}' % group.strip('{}') for group in re.split('\}\s*\{', json_data, flags=re.DOTALL)]
+SESSION_TOKEN_TIMEOUT = 10 * 60  # 10 Minutes
+SESSION_REQUEST_TIMEOUT = 10     # 10 Seconds for a response on a session, unless the client has its own timeout
+# Temperature sampling: every few seconds while clients are watching or the temperature is moving, backing off to a
+# slow pace when nobody is, and never while the servo moves.
+TEMPERATURE_ACTIVE_INTERVAL = 5     # 5 Seconds
+TEMPERATURE_IDLE_INTERVAL = 160     # 160 Seconds
+TEMPERATURE_DEMAND_WINDOW = 30      # Requests from the last 30 seconds count as demand
+TEMPERATURE_CHANGE_THRESHOLD = 0.5  # Celsius between two samples
+CLICK_QUIET_PERIOD = 1              # 1 Second after the servo's last move
+TEMPERATURE_LOG_FILE_NAME = 'temperature.log'
+TEMPERATURE_HISTORY_MAX_BUCKETS = 10000  # Keeps a history response well within the message size limit
+# Pushing events to the subscribed clients
+PUSH_WORKERS = 8        # Deliveries made at the same time
+PUSH_TIMEOUT = 3        # 3 Seconds to connect and deliver, otherwise the subscriber is skipped
+PUSH_QUEUE_SIZE = 100   # Undelivered events kept per subscriber, the oldest are dropped first
+PUSH_WINDOW = 0.2       # Events raised within 0.2 seconds of each other are delivered together
+# Server engines
+ENGINE_THREADS = 'threads'  # A thread per connection
+ENGINE_ASYNC = 'async'      # An event loop for all the connections, and a few threads to run the handlers
+ASYNC_WORKERS = 4           # Threads running the handlers of the async engine
+ENGINE_POOL = 'pool'        # A fixed pool of threads for the connections
+POOL_WORKERS = 32           # Connections and session requests served at the same time by the pool engine
+POOL_QUEUE_SIZE = 64        # Connections and session requests waiting for the pool, more are told the server is busy
+POOL_QUEUE_TIMEOUT = 10     # Seconds a connection may wait for the pool before it's told the server is busy
 
 
 if __name__ == '__main__':
@@ -0,0 +1,63 @@
+import traceback
+from threading import Event, Lock
+
+
+class TimeoutError(Exception):
+    pass
+
+
+class Future(object):
+    """The result of a job that runs on another thread (a serial worker, a session request...)."""
+    def __init__(self):
+        self._done = Event()
+        self._result = None
+        self._exc_info = None
+        self._callbacks = []
+        self._lock = Lock()
+
+    def set_result(self, result):
+        self._result = result
+        self._finish()
+
+    def set_exception(self, exc_info):
+        self._exc_info = exc_info
+        self._finish()
+
+    def _finish(self):
+        with self._lock:
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            self._run_callback(callback)
+
+    def _run_callback(self, callback):
+        try:
+            callback(self)
+        except Exception:
+            traceback.print_exc()
+
+    def add_done_callback(self, callback):
+        """
+        Call ``callback(future)`` once the job is done, on the thread that finished it (or right away if it's done
+        already).
+        """
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(callback)
+                return
+        self._run_callback(callback)
+
+    def done(self):
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """
+        Wait for the job to finish, and return its result (or raise its exception).
+
+        :param timeout: Seconds to wait, ``TimeoutError`` is raised if the job isn't done by then. None waits for good.
+        """
+        if not self._done.wait(timeout):
+            raise TimeoutError('The job is still running after {} seconds'.format(timeout))
+        if self._exc_info:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
@@ -4,7 +4,6 @@ import sys
 from PySide.QtCore import *
 from PySide.QtGui import *
 
-from ClickerGUI import SOFTWARE_NAME
 from consts import *
 from hotkey_listener import HotkeyThread, HotkeySettings
 from notification_widget import NotificationDialog
@@ -92,8 +91,8 @@ class Menu(QMenu):
 
 class MainWindow(QMainWindow):
     update_notifications_signal = Signal(tuple)
-    click_occurred_signal = Signal()
-    auto_clicker_changed_signal = Signal()
+    click_occurred_signal = Signal(dict)
+    auto_clicker_changed_signal = Signal(dict)
 
     def __init__(self, parent=None, flags=0):
         super(MainWindow, self).__init__(parent, flags)
@@ -107,7 +106,6 @@ class MainWindow(QMainWindow):
         self._auto_clicker_seconds_left_for_interval = None
         self._connect_to_server_thread = None  # type: ConnectToServerThread
         self._temperature = None  # type: float
-        self.client_receiver = None
         self._client_connection_check_timer = None
         self._update_auto_clicker_interval_timer = None
         self._update_temperature_timer = None
@@ -116,7 +114,7 @@ class MainWindow(QMainWindow):
         self._notifications_queue = []
         self._notifications_passed = 0
         self.update_notifications_signal.connect(lambda message: self._show_notification(*message))
-        self.click_occurred_signal.connect(lambda: self.click_occurred_signal_receiver())
+        self.click_occurred_signal.connect(lambda server_state: self.click_occurred_signal_receiver(server_state))
         self.mode = self.settings.mode
         self.auto_clicker_changed_signal.connect(self.auto_clicker_changed_receiver)
         if self.mode == SERVER_MODE:
@@ -232,10 +230,6 @@ class MainWindow(QMainWindow):
         if self.client:
             self.client.close()
             self.client = None
-        if self.client_receiver:
-            self.client_receiver.shutdown()
-            self.client_receiver.server_close()
-            self.client_receiver = None
         if self._client_connection_check_timer:
             self.killTimer(self._client_connection_check_timer)
             self._client_connection_check_timer = None
@@ -248,13 +242,6 @@ class MainWindow(QMainWindow):
             self._connect_to_server_thread = None
 
     def connect_to_server(self):
-        from client import run_client_notifications_receiver
-        if self.client_receiver is None:
-            self.client_receiver = run_client_notifications_receiver(
-                handlers={CODE_SHOW_NOTIFICATION: self.handle_show_notification,
-                          CODE_CLICK_HAPPENED: self.handle_click_happened,
-                          CODE_AUTO_CLICKER_CHANGED: self.handle_auto_clicker_changed}
-            )
         if self._connect_to_server_thread is None:
             thread = ConnectToServerThread(self, client=self.client)
             thread.status_updated.connect(self.status_updated)
@@ -265,7 +252,7 @@ class MainWindow(QMainWindow):
     def connect_to_server_finished(self):
         self.client = self._connect_to_server_thread.client
         if self.client:
-            self.auto_clicker_changed_receiver()
+            self.auto_clicker_changed_receiver(self._connect_to_server_thread.server_info)
             self.tray_menu.set_enabled.emit(True)
             self.update_temperature()
         else:
@@ -282,34 +269,45 @@ class MainWindow(QMainWindow):
 
     def update_temperature(self):
         if self.client:
-            self._temperature = self.client.get_temperature()
-            self.tray_menu.set_temperature(self._temperature)
-            if self._temperature:
-                self.tray.setToolTip(u'{} ({}\u00b0C)'.format(self.tray_menu.text, int(round(self._temperature))))
-            else:
-                self.tray.setToolTip(u"{} (Couldn't get temperature)".format(self.tray_menu.text))
+            self._show_temperature(self.client.get_temperature())
         else:
             self.tray_menu.set_temperature(None)
             self.tray.setToolTip(self.tray_menu.text)
+            self._set_notification_temperature()
+
+    def _show_temperature(self, temperature):
+        self._temperature = temperature
+        self.tray_menu.set_temperature(self._temperature)
+        if self._temperature:
+            self.tray.setToolTip(u'{} ({}\u00b0C)'.format(self.tray_menu.text, int(round(self._temperature))))
+        else:
+            self.tray.setToolTip(u"{} (Couldn't get temperature)".format(self.tray_menu.text))
         self._set_notification_temperature()
 
+    def event_handlers(self):
+        return {CODE_SHOW_NOTIFICATION: self.handle_show_notification,
+                CODE_CLICK_HAPPENED: self.handle_click_happened,
+                CODE_AUTO_CLICKER_CHANGED: self.handle_auto_clicker_changed}
+
     def handle_show_notification(self, title, message, **_):
         self.update_notifications_signal.emit((title, message))
 
-    def handle_click_happened(self, **_):
-        self.click_occurred_signal.emit()
+    def handle_click_happened(self, **server_state):
+        self.click_occurred_signal.emit(server_state)
 
-    def handle_auto_clicker_changed(self, **_):
-        self.auto_clicker_changed_signal.emit()
+    def handle_auto_clicker_changed(self, **server_state):
+        self.auto_clicker_changed_signal.emit(server_state)
 
-    def click_occurred_signal_receiver(self):
-        self.auto_clicker_changed_receiver()
+    def click_occurred_signal_receiver(self, server_state):
+        self.auto_clicker_changed_receiver(server_state)
 
-    def auto_clicker_changed_receiver(self):
-        server_info = self.client.server_info()
-        if server_info:
-            self._auto_clicker_interval = server_info.get('auto_clicker_interval')
-            self._auto_clicker_seconds_left_for_interval = server_info.get('auto_clicker_seconds_left_for_interval')
+    def auto_clicker_changed_receiver(self, server_state):
+        """Apply the server's state, as sent along with its events and its server info, no need to ask for it."""
+        if server_state:
+            self._auto_clicker_interval = server_state.get('auto_clicker_interval')
+            self._auto_clicker_seconds_left_for_interval = server_state.get('auto_clicker_seconds_left_for_interval')
+            if server_state.get('temperature') is not None:
+                self._show_temperature(server_state['temperature'])
         if self._auto_clicker_interval:
             self._auto_clicker_interval *= 60
         else:
@@ -388,8 +386,8 @@ class ConnectToServerThread(QThread):
             client = Client()
         else:
             client = self.client
-        if self.parent().client_receiver:
-            client.notifications_server_port = self.parent().client_receiver.server_address[1]
+        # The events are streamed down the client's session.
+        client.event_handlers = self.parent().event_handlers()
         self.status_updated.emit((STATUS_CLIENT_CONNECTING, client.server_name))
         try:
             server_info = client.connect()
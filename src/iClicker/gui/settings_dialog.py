@@ -1,11 +1,10 @@
 from PySide.QtCore import *
 from PySide.QtGui import *
 
-from ClickerGUI import SOFTWARE_NAME
 from consts import *
 from hotkey_listener import HotkeySettings
 from notification_widget import NotificationSettings
-from settings import Settings, ServerSettings, ClientSettings
+from settings import Settings, ServerSettings, ClientSettings, ServerSettingsSnapshot
 
 settings = Settings()
 server_settings = ServerSettings()
@@ -84,8 +83,9 @@ class SettingsDialog(QDialog):
         self.close()
 
     def apply_button_clicked(self):
-        settings.mode = self.mode.currentText()
-        [widget.save() for widget in self.all_settings()]
+        with settings.batch():
+            settings.mode = self.mode.currentText()
+            [widget.save() for widget in self.all_settings()]
         self._is_apply_clicked = True
 
     def exec_(self):
@@ -143,6 +143,8 @@ class ServerSettings(BaseModeSettings):
         server_settings.server_port = self.server_port.value()
         if self.server_password.is_changed:
             server_settings.server_password = self.server_password.text()
+        # A running server picks the changes up right away.
+        ServerSettingsSnapshot.reload()
 
 
 class ClientSettings(BaseModeSettings):
@@ -441,31 +443,34 @@ class ClickerCalibrator(QDialog):
         self.clicker.custom_click(new_value, self.neutral_position.spin_box.value())
 
     def reset_values(self):
-        self.clicker.disable_click2()
-        self.clicker.click_pos = 120
-        self.clicker.released_pos = 90
+        from serial_api import CODE_SET_CLICK2_POS, CODE_SET_CLICK_POS, CODE_SET_RELEASED_POS
+        self.clicker.batch((CODE_SET_CLICK2_POS, 255), (CODE_SET_CLICK_POS, 120), (CODE_SET_RELEASED_POS, 90))
         self.fill_values()
 
     def fill_values(self):
-        is_switch_on_off = self.clicker.is_click2_enabled()
-        released_value = self.clicker.released_pos
+        from serial_api import is_click2_pos_enabled
+        state = self.clicker.read_state()
+        is_switch_on_off = is_click2_pos_enabled(state.click2_pos)
+        released_value = state.released_pos
         self.is_switch_on_off.setChecked(is_switch_on_off)
         if is_switch_on_off:
-            self.switch_off_position.spin_box.setValue(self.clicker.click2_pos)
+            self.switch_off_position.spin_box.setValue(state.click2_pos)
             self.switch_off_position.setEnabled(True)
         else:
             self.switch_off_position.spin_box.setValue(released_value)
             self.switch_off_position.setEnabled(False)
         self.neutral_position.spin_box.setValue(released_value)
-        self.switch_on_position.spin_box.setValue(self.clicker.click_pos)
+        self.switch_on_position.spin_box.setValue(state.click_pos)
 
     def save(self):
+        from serial_api import CODE_SET_CLICK2_POS, CODE_SET_CLICK_POS, CODE_SET_RELEASED_POS
         if self.is_switch_on_off.isChecked():
-            self.clicker.click2_pos = self.switch_off_position.spin_box.value()
+            click2_pos = self.switch_off_position.spin_box.value()
         else:
-            self.clicker.disable_click2()
-        self.clicker.click_pos = self.switch_on_position.spin_box.value()
-        self.clicker.released_pos = self.neutral_position.spin_box.value()
+            click2_pos = 255
+        self.clicker.batch((CODE_SET_CLICK2_POS, click2_pos),
+                           (CODE_SET_CLICK_POS, self.switch_on_position.spin_box.value()),
+                           (CODE_SET_RELEASED_POS, self.neutral_position.spin_box.value()))
         self.close()
 
     def close(self):
@@ -0,0 +1,152 @@
+"""
+The framing of the messages between clients and servers: each message is a 4 byte big-endian length followed by that
+many bytes of payload.
+
+A payload is either JSON or, once both sides agreed on it, binary: a marker byte and the code packed into a header,
+followed by the rest of the message as compact JSON (nothing at all if there's no rest). Binary messages leave out the
+sender's name, the receiver already knows it from the sender's first (JSON) message.
+
+The codec is negotiated by the side that opens the connection offering ``codecs`` in its first message, and the other
+side answering with the chosen ``codec`` in its first message. Payloads are recognized by their first byte, so either
+codec can always be read.
+"""
+import json
+import struct
+from socket import error
+
+HEADER = struct.Struct('!I')
+BINARY_HEADER = struct.Struct('!cB')
+BINARY_MARKER = '\x00'
+# Anything longer is surely not a message, rather a peer that doesn't speak the protocol.
+MAX_MESSAGE_SIZE = 16 * 1024 * 1024
+
+CODEC_JSON = 'json'
+CODEC_BINARY = 'binary'
+SUPPORTED_CODECS = (CODEC_BINARY, CODEC_JSON)
+
+
+class ProtocolError(error):
+    pass
+
+
+def negotiate_codec(offered_codecs):
+    """Pick the codec to use with a peer that offered the given codecs (None for a peer that offered nothing)."""
+    for codec in SUPPORTED_CODECS:
+        if codec in (offered_codecs or ()):
+            return codec
+    return CODEC_JSON
+
+
+def encode_payload(message, codec=CODEC_JSON):
+    if codec == CODEC_BINARY:
+        rest = dict((key, value) for key, value in message.iteritems() if key not in ('code', 'name'))
+        return BINARY_HEADER.pack(BINARY_MARKER, message['code']) + \
+            (json.dumps(rest, separators=(',', ':')) if rest else '')
+    return json.dumps(message)
+
+
+def decode_payload(payload, peer_name=None):
+    if payload[:1] == BINARY_MARKER:
+        _, code = BINARY_HEADER.unpack_from(payload)
+        message = json.loads(payload[BINARY_HEADER.size:]) if len(payload) > BINARY_HEADER.size else {}
+        message['code'] = code
+        if peer_name is not None:
+            message['name'] = peer_name
+        return message
+    return json.loads(payload)
+
+
+def encode_message(message, codec=CODEC_JSON):
+    payload = encode_payload(message, codec)
+    return HEADER.pack(len(payload)) + payload
+
+
+def send_message(sock, message, codec=CODEC_JSON):
+    sock.sendall(encode_message(message, codec))
+
+
+def send_messages(sock, messages, codec=CODEC_JSON):
+    """Send several messages back to back in a single write."""
+    sock.sendall(''.join(encode_message(message, codec) for message in messages))
+
+
+class MessageReader(object):
+    """
+    Reads messages from a socket into a single buffer that's reused for the whole connection. Whatever arrives past the
+    end of a message is kept for the next ``read``.
+    """
+    def __init__(self, sock, buffer_size=4096):
+        self.peer_name = None
+        self._socket = sock
+        self._buffer = bytearray(buffer_size)
+        self._start = 0
+        self._end = 0
+
+    def _buffered_message_length(self):
+        """The length of the message at the start of the buffer if it's all there, None otherwise."""
+        if self._end - self._start < HEADER.size:
+            return None
+        length, = HEADER.unpack_from(self._buffer, self._start)
+        if length > MAX_MESSAGE_SIZE:
+            raise ProtocolError('A message of {} bytes is too long'.format(length))
+        if self._end - self._start - HEADER.size < length:
+            return None
+        return length
+
+    def _make_room(self):
+        """Move the unread bytes to the start of the buffer, and grow it if the message being read won't fit."""
+        unread = self._end - self._start
+        if self._start:
+            self._buffer[:unread] = self._buffer[self._start:self._end]
+            self._start, self._end = 0, unread
+        needed = HEADER.size
+        if unread >= HEADER.size:
+            needed += HEADER.unpack_from(self._buffer, 0)[0]
+        if needed > len(self._buffer):
+            self._buffer.extend(bytearray(needed - len(self._buffer)))
+
+    def fill(self):
+        """
+        Receive whatever the socket has into the buffer, with a single ``recv``.
+
+        :return: The number of bytes received, 0 if the connection was closed.
+        :rtype: int
+        """
+        if self._end == len(self._buffer) or self._start == self._end:
+            self._make_room()
+        received = self._socket.recv_into(memoryview(self._buffer)[self._end:])
+        self._end += received
+        return received
+
+    def read(self):
+        """
+        Read the next message.
+
+        :return: The message, or None if the connection was closed.
+        :rtype: dict
+        """
+        message = self.read_buffered()
+        while message is None:
+            if not self.fill():
+                if self._start != self._end:
+                    raise ProtocolError('The connection was closed in the middle of a message')
+                return None
+            message = self.read_buffered()
+        return message
+
+    def read_buffered(self):
+        """
+        Read the next message if it was already received, without waiting for the socket.
+
+        :return: The message, or None if it isn't all in the buffer yet.
+        :rtype: dict
+        """
+        length = self._buffered_message_length()
+        if length is None:
+            return None
+        start = self._start + HEADER.size
+        self._start = start + length
+        message = decode_payload(str(self._buffer[start:self._start]), self.peer_name)
+        if 'name' in message:
+            self.peer_name = message['name']
+        return message
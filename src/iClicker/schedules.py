@@ -0,0 +1,150 @@
+"""
+The auto clicker's schedules. The server may have several at once, each clicking either every few minutes or by a
+cron-style rule (e.g. every 10 minutes during work hours, plus 07:00 every day), and keeps them in its settings so they
+survive a restart.
+"""
+import datetime
+import os
+import time
+
+SCHEDULE_INTERVAL = 'interval'
+SCHEDULE_CRON = 'cron'
+# The schedule set by the (single interval) auto clicker.
+DEFAULT_SCHEDULE_ID = 'default'
+
+
+class CronRule(object):
+    """
+    A rule in crontab's format: "minute hour day-of-month month day-of-week". Each field is ``*``, a number, a range
+    (``9-17``), a step (``*/10``, ``9-17/2``) or a comma separated list of those. Days of the week are 0-6 from Sunday
+    (7 is Sunday too). Like cron, when both days of the month and of the week are given, either one matching is enough.
+    """
+    FIELDS = (('minute', 0, 59), ('hour', 0, 23), ('day', 1, 31), ('month', 1, 12), ('weekday', 0, 7))
+    # No rule goes this long without a match (the 29th of February included).
+    MAX_DAYS_AHEAD = 8 * 366
+
+    def __init__(self, rule):
+        self.rule = rule
+        fields = rule.split()
+        if len(fields) != len(self.FIELDS):
+            raise ValueError('A cron rule has {} fields, got {!r}'.format(len(self.FIELDS), rule))
+        values = [self._parse_field(field, name, low, high)
+                  for field, (name, low, high) in zip(fields, self.FIELDS)]
+        self.minutes, self.hours, self.days, self.months, weekdays = [sorted(value) for value in values]
+        self.weekdays = set(weekday % 7 for weekday in weekdays)
+        self._is_day_restricted = fields[2] != '*'
+        self._is_weekday_restricted = fields[4] != '*'
+
+    @staticmethod
+    def _parse_field(field, name, low, high):
+        values = set()
+        for part in field.split(','):
+            value_range, _, step = part.partition('/')
+            try:
+                step = int(step) if step else 1
+                if value_range == '*':
+                    start, end = low, high
+                elif '-' in value_range:
+                    start, end = [int(value) for value in value_range.split('-', 1)]
+                else:
+                    start = end = int(value_range)
+            except ValueError:
+                raise ValueError('Bad {} field: {!r}'.format(name, field))
+            if step < 1 or not low <= start <= end <= high:
+                raise ValueError('Bad {} field: {!r}'.format(name, field))
+            values.update(xrange(start, end + 1, step))
+        return values
+
+    def _is_matching_day(self, date):
+        is_day = date.day in self.days
+        # isoweekday() is 1-7 from Monday, cron's is 0-6 from Sunday.
+        is_weekday = date.isoweekday() % 7 in self.weekdays
+        if self._is_day_restricted and self._is_weekday_restricted:
+            return is_day or is_weekday
+        return is_day and is_weekday
+
+    def next_time(self, after):
+        """
+        The first (local) time the rule matches, after the given one.
+
+        :type after: float
+        :rtype: float
+        """
+        start = datetime.datetime.fromtimestamp(after).replace(second=0, microsecond=0) + \
+            datetime.timedelta(minutes=1)
+        date = start.date()
+        for _ in xrange(self.MAX_DAYS_AHEAD):
+            if date.month in self.months and self._is_matching_day(date):
+                for hour in self.hours:
+                    for minute in self.minutes:
+                        candidate = datetime.datetime(date.year, date.month, date.day, hour, minute)
+                        if candidate >= start:
+                            return time.mktime(candidate.timetuple())
+            date += datetime.timedelta(days=1)
+        raise ValueError('The cron rule {!r} never matches'.format(self.rule))
+
+
+class AutoClickSchedule(object):
+    """
+    When the auto clicker clicks: every ``interval`` minutes counted from ``start_time``, or whenever the ``cron`` rule
+    matches.
+    """
+    def __init__(self, schedule_id=None, interval=None, cron=None, is_enabled=True, start_time=None):
+        if (interval is None) == (cron is None):
+            raise ValueError('A schedule has either an interval or a cron rule')
+        if interval is not None and (not isinstance(interval, (int, long)) or isinstance(interval, bool) or
+                                     interval <= 0):
+            raise ValueError('The interval must be a positive number of minutes, got {!r}'.format(interval))
+        if cron is not None and not isinstance(cron, basestring):
+            raise ValueError('The cron rule must be a string, got {!r}'.format(cron))
+        if schedule_id is not None and not isinstance(schedule_id, basestring):
+            raise ValueError('The ID must be a string, got {!r}'.format(schedule_id))
+        if start_time is not None and (not isinstance(start_time, (int, long, float)) or isinstance(start_time, bool)):
+            raise ValueError('The start time must be a timestamp, got {!r}'.format(start_time))
+        self.schedule_id = schedule_id or os.urandom(4).encode('hex')
+        self.interval = interval
+        self.cron = cron
+        self.is_enabled = bool(is_enabled)
+        self.start_time = start_time if start_time is not None else time.time()
+        self._cron_rule = CronRule(cron) if cron is not None else None
+        if self._cron_rule is not None:
+            # A rule may be well formed and still never match (e.g. the 30th of February).
+            self._cron_rule.next_time(self.start_time)
+
+    @property
+    def kind(self):
+        return SCHEDULE_INTERVAL if self.interval is not None else SCHEDULE_CRON
+
+    def next_fire_time(self, after=None):
+        """
+        :return: When the schedule clicks next, after the given time (now by default), None if it's disabled.
+        :rtype: float
+        """
+        if not self.is_enabled:
+            return None
+        after = after if after is not None else time.time()
+        if self._cron_rule is not None:
+            return self._cron_rule.next_time(after)
+        interval = self.interval * 60
+        if after < self.start_time:
+            return self.start_time + interval
+        # Counted from the start time rather than from the last click, so it doesn't drift or restart on a restart.
+        return self.start_time + (int((after - self.start_time) // interval) + 1) * interval
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        :raise ValueError: If it isn't a valid schedule.
+        :rtype: AutoClickSchedule
+        """
+        if not isinstance(data, dict):
+            raise ValueError('A schedule is a dict, got {!r}'.format(data))
+        return cls(data.get('id'), data.get('interval'), data.get('cron'), data.get('enabled', True),
+                   data.get('start_time'))
+
+    def to_dict(self):
+        """
+        :rtype: dict
+        """
+        return dict(id=self.schedule_id, kind=self.kind, interval=self.interval, cron=self.cron,
+                    enabled=self.is_enabled, start_time=self.start_time)
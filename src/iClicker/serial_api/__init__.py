@@ -1,4 +1,14 @@
+import sys
+import traceback
+from Queue import PriorityQueue
+from bisect import bisect_left
+from collections import namedtuple, defaultdict
 from contextlib import contextmanager
+from itertools import count
+from threading import Event, Lock, RLock, Thread, current_thread
+from time import time
+
+from futures import Future
 
 CODE_GET_CLICK_POS = 1
 CODE_SET_CLICK_POS = 2
@@ -13,80 +23,578 @@ CODE_CUSTOM_CLICK = 10
 CODE_MOVE_CLICKER = 11
 CODE_RESET_CLICKER = 12
 
+# How to parse the reply of each code that has one.
+_REPLY_PARSERS = {
+    CODE_GET_CLICK_POS: int,
+    CODE_GET_RELEASED_POS: int,
+    CODE_GET_CLICK2_POS: int,
+    CODE_GET_TEMPERATURE: float,
+}
+
+# The code that reads back the position each setter code writes.
+_POSITION_SETTERS = {
+    CODE_SET_CLICK_POS: CODE_GET_CLICK_POS,
+    CODE_SET_RELEASED_POS: CODE_GET_RELEASED_POS,
+    CODE_SET_CLICK2_POS: CODE_GET_CLICK2_POS,
+}
+
+# Priorities of the commands waiting for the serial worker, lower goes first.
+PRIORITY_CLICK = 0
+PRIORITY_CALIBRATION = 1
+PRIORITY_TEMPERATURE = 2
+
+_CODE_PRIORITIES = {
+    CODE_CLICK: PRIORITY_CLICK,
+    CODE_CLICK2: PRIORITY_CLICK,
+    CODE_GET_TEMPERATURE: PRIORITY_TEMPERATURE,
+}
 
 VID = 0x1B4F
 PID = 0x9206
 
+# Opening a port that exists is retried briefly (it may still be busy right after it's plugged in). After that, the
+# clicker is considered disconnected until the prober reconnects it, probing with a backoff between these delays.
+OPEN_ATTEMPTS = 3
+OPEN_RETRY_DELAY = 0.2
+PROBE_MIN_DELAY = 0.5
+PROBE_MAX_DELAY = 30
+
+# Seconds to wait for a reply, on top of the time the servo moves queued before the command should take.
+READ_TIMEOUT = 5
+# Seconds the firmware waits for each servo move, and the moves each command makes.
+SERVO_MOVE_TIME = 0.5
+_CODE_MOVES = {
+    CODE_CLICK: 2,
+    CODE_CLICK2: 2,
+    CODE_CUSTOM_CLICK: 2,
+    CODE_MOVE_CLICKER: 1,
+    CODE_RESET_CLICKER: 1,
+}
+
+
+def is_click2_pos_enabled(click2_pos):
+    return 0 <= click2_pos <= 180
+
+
+def _is_position_accepted(setter_code, angle):
+    """Whether the firmware stores the given angle, it silently ignores values outside the servo's range."""
+    return 0 <= angle <= 180 or (setter_code == CODE_SET_CLICK2_POS and angle == 255)
+
+
+def _codes_priority(codes):
+    return min(_CODE_PRIORITIES.get(code, PRIORITY_CALIBRATION) for code in codes)
+
+
+ClickerState = namedtuple('ClickerState', ('click_pos', 'click2_pos', 'released_pos', 'temperature'))
+
+
+def _serial_devices_signature():
+    """
+    Return a cheap fingerprint of the serial devices currently present, or None if there's no cheap way to get one on
+    this platform.
+    """
+    import os
+    if os.path.isdir('/sys/class/tty'):
+        return frozenset(os.listdir('/sys/class/tty'))
+    if sys.platform == 'win32':
+        import _winreg
+        try:
+            key = _winreg.OpenKey(_winreg.HKEY_LOCAL_MACHINE, r'HARDWARE\DEVICEMAP\SERIALCOMM')
+        except WindowsError:
+            # The key only exists while there's at least one serial device.
+            return frozenset()
+        devices = set()
+        try:
+            i = 0
+            while True:
+                devices.add(_winreg.EnumValue(key, i)[:2])
+                i += 1
+        except WindowsError:
+            pass
+        finally:
+            _winreg.CloseKey(key)
+        return frozenset(devices)
+    if sys.platform == 'darwin':
+        return frozenset(name for name in os.listdir('/dev') if name.startswith(('cu.', 'tty.')))
+    return None
+
+
+class NoClickerError(Exception):
+    pass
+
+
+class LatencyHistogram(object):
+    # Upper bounds of the buckets, in milliseconds. Anything slower lands in an extra overflow bucket.
+    BOUNDS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+    def __init__(self):
+        self.buckets = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def add(self, seconds):
+        ms = seconds * 1000
+        self.buckets[bisect_left(self.BOUNDS, ms)] += 1
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+
+    def snapshot(self):
+        labels = ['<={}'.format(bound) for bound in self.BOUNDS] + ['>{}'.format(self.BOUNDS[-1])]
+        return dict(count=self.count,
+                    avg_ms=self.total_ms / self.count if self.count else None,
+                    max_ms=self.max_ms,
+                    buckets=dict((label, n) for label, n in zip(labels, self.buckets) if n))
+
+
+class ClickerStats(object):
+    """
+    Counters and latency histograms of a clicker's serial traffic.
+
+    Latencies: ``queue`` (waiting for the worker), ``open``, and per command ``write:<code>``, ``readline:<code>`` and
+    ``transaction:<code>`` (``batch`` stands for a transaction of several commands). Counters: ``commands:<code>``,
+    ``errors:<code>``, ``open_retries``, ``open_failures``, ``stale_reopens``, ``skipped_replies`` and
+    ``rejected_while_disconnected``.
+    """
+    def __init__(self):
+        self._lock = Lock()
+        self._latencies = defaultdict(LatencyHistogram)
+        self._counters = defaultdict(int)
+        self.since = time()
+
+    def add_latency(self, name, seconds):
+        with self._lock:
+            self._latencies[name].add(seconds)
+
+    def increment(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def snapshot(self):
+        with self._lock:
+            return dict(since=self.since,
+                        counters=dict(self._counters),
+                        latencies=dict((name, histogram.snapshot()) for name, histogram in self._latencies.items()))
+
+    def reset(self):
+        with self._lock:
+            self._latencies.clear()
+            self._counters.clear()
+            self.since = time()
+
+
+class SerialWorker(Thread):
+    """The only thread that talks to a clicker, it runs the submitted jobs by priority, then by submission order."""
+    def __init__(self, name):
+        super(SerialWorker, self).__init__(name=name)
+        self.daemon = True
+        self._queue = PriorityQueue()
+        self._sequence = count()
+
+    def submit(self, priority, method, *args):
+        """
+        :rtype: Future
+        """
+        future = Future()
+        self._queue.put((priority, next(self._sequence), method, args, future))
+        return future
+
+    def run(self):
+        while True:
+            _, _, method, args, future = self._queue.get()
+            try:
+                future.set_result(method(*args))
+            except Exception:
+                future.set_exception(sys.exc_info())
+
 
 class Clicker(object):
+    """
+    A handle to the clicker connected on a given port.
+
+    There's only one Clicker per port: it owns a long-lived serial session that's opened on the first command, reused
+    by every command that follows, and reopened only after an error.
+
+    The positions are mirrored in memory: they're read from the device once, setters write through to both, and
+    ``refresh_positions``/``invalidate_positions`` cover changes made behind the clicker's back.
+
+    All the I/O runs on a single ``SerialWorker``, so concurrent callers queue by priority (clicks first) instead of
+    racing for the port.
+
+    Once the clicker can't be reached, commands fail right away with ``NoClickerError`` while a background prober waits
+    for it to come back.
+
+    ``stats`` keeps track of how long each stage of the serial traffic takes, see ``ClickerStats``.
+    """
+    _instances = {}
+    _instances_lock = Lock()
+
+    def __new__(cls, port=None):
+        with cls._instances_lock:
+            instance = cls._instances.get(port)
+            if instance is None:
+                instance = object.__new__(cls)
+                Clicker.__init__(instance, port)
+                cls._instances[port] = instance
+        return instance
+
+    def __init__(self, port=None):
+        if Clicker._instances.get(port) is self:
+            return
+        self.port = port
+        self._serial = None
+        # Replies the clicker still owes for commands whose reply didn't come in time.
+        self._owed_replies = 0
+        # When the servo moves sent so far should be over.
+        self._busy_until = 0
+        self._positions = None  # type: dict[int, int]
+        self._lock = RLock()
+        self._worker = None  # type: SerialWorker
+        self._worker_lock = Lock()
+        self._is_disconnected = False
+        self._prober = None  # type: Thread
+        self._stop_probing = Event()
+        self.stats = ClickerStats()
+
+    # The last resolved clicker port, and the signature of the serial devices present when it was resolved.
+    _found_port = None
+    _found_port_signature = None
+    _found_port_lock = Lock()
+
     @classmethod
     def find_clicker_port(cls):
-        from serial.tools.list_ports import comports
-        for port in comports():
-            if port.pid == PID and port.vid == VID:
-                return port.device
+        """
+        Find the port the clicker is connected to.
 
-    @contextmanager
-    def _serial_interaction(self, code):
-        from time import sleep
+        Enumerating the ports is slow, so the result is cached until the set of serial devices changes (or until
+        ``invalidate_port_cache`` is called).
+        """
+        signature = _serial_devices_signature()
+        with cls._found_port_lock:
+            if signature is not None and signature == cls._found_port_signature:
+                return cls._found_port
+            from serial.tools.list_ports import comports
+            cls._found_port = None
+            for port in comports():
+                if port.pid == PID and port.vid == VID:
+                    cls._found_port = port.device
+                    break
+            cls._found_port_signature = signature
+            return cls._found_port
+
+    @classmethod
+    def invalidate_port_cache(cls):
+        with cls._found_port_lock:
+            cls._found_port_signature = None
 
+    def _connect(self, port):
+        """Try to open the session on the given port once, return whether it worked."""
         from serial import Serial, SerialException
-        port = self.port or self.find_clicker_port()
-        serial = None
-        a = 0
-        while not serial and a < 10:
+        start_time = time()
+        try:
+            self._serial = Serial(port, timeout=READ_TIMEOUT)
+        except SerialException:
+            return False
+        self.stats.add_latency('open', time() - start_time)
+        # It might be a different clicker now.
+        self.invalidate_positions()
+        return True
+
+    def _open_serial(self):
+        from time import sleep
+        if self._serial is not None:
+            return self._serial
+        if self._is_disconnected:
+            self.stats.increment('rejected_while_disconnected')
+            raise NoClickerError("The clicker is disconnected.")
+        port = None
+        for attempt in xrange(OPEN_ATTEMPTS):
+            if attempt:
+                self.stats.increment('open_retries')
+                sleep(OPEN_RETRY_DELAY)
+            # Resolve the port on each attempt, a re-plugged clicker may show up on a different one.
+            port = self.port or self.find_clicker_port()
+            if port is None:
+                break
+            if self._connect(port):
+                return self._serial
+            if not self.port:
+                self.invalidate_port_cache()
+        self.stats.increment('open_failures')
+        self._set_disconnected()
+        raise NoClickerError("Couldn't connect to the clicker at port {}.".format(port) if port else
+                             "Couldn't find the clicker.")
+
+    def _set_disconnected(self):
+        """Fail every command fast from now on, until the prober manages to reconnect."""
+        self._is_disconnected = True
+        if self._prober is None or not self._prober.is_alive():
+            self._stop_probing.clear()
+            self._prober = Thread(target=self._probe, name='Clicker prober ({})'.format(self.port or 'auto'))
+            self._prober.daemon = True
+            self._prober.start()
+
+    def _probe(self):
+        delay = PROBE_MIN_DELAY
+        while not self._stop_probing.wait(delay):
+            try:
+                port = self.port or self.find_clicker_port()
+                if port is None:
+                    # Finding the port is cheap while the serial devices don't change, so keep watching closely.
+                    delay = PROBE_MIN_DELAY
+                    continue
+                with self._lock:
+                    if self._serial is not None or self._connect(port):
+                        self._is_disconnected = False
+                        return
+            except Exception:
+                # Whatever went wrong, the commands keep failing fast until the prober reconnects.
+                traceback.print_exc()
+            delay = min(delay * 2, PROBE_MAX_DELAY)
+
+    def is_connected(self):
+        """Whether the clicker is believed to be connected, without touching the device."""
+        return not self._is_disconnected
+
+    def _close_serial(self):
+        with self._lock:
+            if self._serial is not None:
+                try:
+                    self._serial.close()
+                except Exception:
+                    pass
+                self._serial = None
+
+    def idle_time(self):
+        """When the servo should be done with the moves sent so far (0 if it never moved)."""
+        return self._busy_until
+
+    def seconds_until_idle(self):
+        """How long until the servo should be done with the moves sent so far."""
+        return max(0, self._busy_until - time())
+
+    def _set_read_timeout(self, serial):
+        # The clicker handles the commands in order, so a reply waits for the moves queued before it.
+        timeout = READ_TIMEOUT + self.seconds_until_idle()
+        if serial.timeout != timeout:
+            serial.timeout = timeout
+
+    def _resync(self, serial):
+        """
+        Skip the replies still owed for commands whose reply didn't come in time, so they aren't taken as the replies
+        of the next commands. They get another full read timeout to come.
+        """
+        self._set_read_timeout(serial)
+        deadline = time() + serial.timeout
+        while self._owed_replies:
+            reply = serial.readline()
+            if reply.endswith('\n'):
+                self._owed_replies -= 1
+                self.stats.increment('skipped_replies')
+            elif time() >= deadline:
+                # The owed replies are lost (e.g. the clicker restarted), drop whatever part of them came.
+                serial.reset_input_buffer()
+                break
+        self._owed_replies = 0
+
+    def close(self):
+        """Close the session and stop looking for a disconnected clicker, the next command will reopen it."""
+        self._stop_probing.set()
+        self._is_disconnected = False
+        self._close_serial()
+
+    @contextmanager
+    def _serial_interaction(self, lines, stats_key):
+        from serial import SerialException
+        payload = ''.join(str(line) + '\n' for line in lines)
+        with self._lock:
+            was_open = self._serial is not None
+            serial = self._open_serial()
+            if self._owed_replies:
+                self._resync(serial)
+            start_time = time()
             try:
-                serial = Serial(port)
-            except SerialException:
-                sleep(1)
-                a += 1
-        if not serial:
-            raise SerialException("Couldn't connect to the clicker at port {}".format(port))
-        serial.write(str(code) + '\n')
-        yield serial
-        serial.close()
+                serial.write(payload)
+            except (SerialException, OSError):
+                self._close_serial()
+                if not was_open:
+                    raise
+                # The session went stale (e.g. the clicker was re-plugged), reopen it once and try again.
+                self.stats.increment('stale_reopens')
+                serial = self._open_serial()
+                start_time = time()
+                serial.write(payload)
+            self.stats.add_latency('write:{}'.format(stats_key), time() - start_time)
+            try:
+                yield serial
+            except Exception:
+                if not self._owed_replies:
+                    # The session is resynced instead of reopened when it's only behind on replies.
+                    self._close_serial()
+                raise
+
+    def _transact(self, lines, reply_codes, stats_key, moves=0):
+        """
+        Write all the lines at once, then read a reply for each of the ``reply_codes``.
+
+        :param moves: The servo moves the lines make.
+        :rtype: list[str]
+        """
+        from serial import SerialException
+        with self._serial_interaction(lines, stats_key) as serial:
+            if moves:
+                self._busy_until = max(self._busy_until, time()) + moves * SERVO_MOVE_TIME
+            if reply_codes:
+                self._set_read_timeout(serial)
+            replies = []
+            for code in reply_codes:
+                start_time = time()
+                reply = serial.readline()
+                self.stats.add_latency('readline:{}'.format(code), time() - start_time)
+                if not reply.endswith('\n'):
+                    # The reply may still come (or the rest of it), it's skipped before the next command.
+                    self._owed_replies += len(reply_codes) - len(replies)
+                    raise SerialException("The clicker didn't reply to {!r}".format(lines))
+                replies.append(reply)
+        return replies
+
+    def submit(self, priority, method, *args):
+        """
+        Run ``method(*args)`` on the serial worker.
+
+        Jobs submitted from the worker itself (e.g. a command issued by a submitted job) run right away.
+
+        :param priority: One of the ``PRIORITY_*`` values.
+        :rtype: Future
+        """
+        if current_thread() is self._worker:
+            future = Future()
+            try:
+                future.set_result(method(*args))
+            except Exception:
+                future.set_exception(sys.exc_info())
+            return future
+        with self._worker_lock:
+            if self._worker is None:
+                self._worker = SerialWorker('Clicker worker ({})'.format(self.port or 'auto'))
+                self._worker.start()
+        return self._worker.submit(priority, self._timed_job, time(), method, args)
+
+    def _timed_job(self, submit_time, method, args):
+        self.stats.add_latency('queue', time() - submit_time)
+        return method(*args)
 
     def _send_code(self, code):
-        with self._serial_interaction(code):
-            pass
+        self.batch(code)
 
     def _send_data(self, code, *data):
-        with self._serial_interaction(code) as serial:
-            for obj in data:
-                serial.write(str(obj) + '\n')
+        self.batch((code, ) + data)
 
     def _get_data(self, code):
-        with self._serial_interaction(code) as serial:
-            data = serial.readline()
-        return data
+        return self.batch(code)[0]
+
+    def batch(self, *commands):
+        """
+        Run several commands in a single transaction.
+
+        Each command is either a code or a tuple of a code followed by its arguments, e.g.
+        ``clicker.batch(CODE_GET_CLICK_POS, (CODE_MOVE_CLICKER, 90))``. The clicker handles the commands in order.
+
+        :return: The parsed reply of each command, or None for commands that have no reply.
+        :rtype: list
+        """
+        commands = [command if isinstance(command, tuple) else (command, ) for command in commands]
+        priority = _codes_priority([command[0] for command in commands])
+        return self.submit(priority, self._batch, commands).result()
+
+    def _batch(self, commands):
+        lines = [line for command in commands for line in command]
+        codes = [command[0] for command in commands]
+        stats_key = codes[0] if len(codes) == 1 else 'batch'
+        for code in codes:
+            self.stats.increment('commands:{}'.format(code))
+        start_time = time()
+        with self._lock:
+            try:
+                replies = iter(self._transact(lines, [code for code in codes if code in _REPLY_PARSERS], stats_key,
+                                              sum(_CODE_MOVES.get(code, 0) for code in codes)))
+            except Exception:
+                self.stats.increment('errors:{}'.format(stats_key))
+                raise
+            results = [_REPLY_PARSERS[code](next(replies)) if code in _REPLY_PARSERS else None for code in codes]
+            self._update_positions(zip(commands, results))
+        self.stats.add_latency('transaction:{}'.format(stats_key), time() - start_time)
+        return results
+
+    def _update_positions(self, commands_and_results):
+        positions = dict(self._positions or {})
+        for command, result in commands_and_results:
+            code = command[0]
+            if code in _POSITION_SETTERS:
+                angle = int(command[1])
+                if _is_position_accepted(code, angle):
+                    positions[_POSITION_SETTERS[code]] = angle
+            elif code in _REPLY_PARSERS and code != CODE_GET_TEMPERATURE:
+                positions[code] = result
+        # Replace rather than update, so readers never see a half-updated mirror.
+        self._positions = positions
+
+    def _position(self, code):
+        positions = self._positions
+        if positions is None or code not in positions:
+            positions = self.refresh_positions()
+        return positions[code]
+
+    def refresh_positions(self):
+        """
+        Re-read all the positions from the device into the mirror.
+
+        :rtype: dict[int, int]
+        """
+        codes = (CODE_GET_CLICK_POS, CODE_GET_CLICK2_POS, CODE_GET_RELEASED_POS)
+        return dict(zip(codes, self.batch(*codes)))
+
+    def invalidate_positions(self):
+        """Forget the mirrored positions, they'll be read from the device the next time they're needed."""
+        self._positions = None
+
+    def read_state(self):
+        """
+        Read the positions and the temperature in one transaction.
+
+        :rtype: ClickerState
+        """
+        return ClickerState(*self.batch(CODE_GET_CLICK_POS, CODE_GET_CLICK2_POS, CODE_GET_RELEASED_POS,
+                                        CODE_GET_TEMPERATURE))
 
     @property
     def temperature(self):
-        return float(self._get_data(CODE_GET_TEMPERATURE))
+        return self._get_data(CODE_GET_TEMPERATURE)
 
     @property
     def click_pos(self):
-        return int(self._get_data(CODE_GET_CLICK_POS))
+        return self._position(CODE_GET_CLICK_POS)
 
     @property
     def click2_pos(self):
-        return int(self._get_data(CODE_GET_CLICK2_POS))
+        return self._position(CODE_GET_CLICK2_POS)
 
     @property
     def released_pos(self):
-        return int(self._get_data(CODE_GET_RELEASED_POS))
+        return self._position(CODE_GET_RELEASED_POS)
 
     @click_pos.setter
     def click_pos(self, angle):
-        self._send_data(CODE_SET_CLICK_POS, angle)
+        self.batch((CODE_SET_CLICK_POS, angle))
 
     @click2_pos.setter
     def click2_pos(self, angle):
-        self._send_data(CODE_SET_CLICK2_POS, angle)
+        self.batch((CODE_SET_CLICK2_POS, angle))
 
     @released_pos.setter
     def released_pos(self, angle):
-        self._send_data(CODE_SET_RELEASED_POS, angle)
+        self.batch((CODE_SET_RELEASED_POS, angle))
 
     def click(self):
         self._send_code(CODE_CLICK)
@@ -104,10 +612,7 @@ class Clicker(object):
         self._send_code(CODE_RESET_CLICKER)
 
     def is_click2_enabled(self):
-        return 0 <= self.click2_pos <= 180
+        return is_click2_pos_enabled(self.click2_pos)
 
     def disable_click2(self):
         self.click2_pos = 255
-
-    def __init__(self, port=None):
-            self.port = port
@@ -0,0 +1,182 @@
+"""
+A virtual clicker that runs the firmware's protocol over a pseudo-terminal (Linux/macOS only).
+
+Point ``Clicker(port=virtual_clicker.port)`` at it to measure or exercise the serial path without the actual device.
+"""
+import os
+import random
+import time
+from threading import Thread, Event, Lock
+
+from serial_api import CODE_GET_CLICK_POS, CODE_SET_CLICK_POS, CODE_GET_RELEASED_POS, CODE_SET_RELEASED_POS, \
+    CODE_GET_CLICK2_POS, CODE_SET_CLICK2_POS, CODE_GET_TEMPERATURE, CODE_CLICK, CODE_CLICK2, CODE_CUSTOM_CLICK, \
+    CODE_MOVE_CLICKER, CODE_RESET_CLICKER
+
+
+class VirtualClicker(object):
+    """
+    Emulates the clicker's firmware (``Arduino.ino``): the same codes, the same "EEPROM" defaults and the same replies.
+
+    :param latency: Seconds to wait before handling each command.
+    :param jitter: Up to this many seconds are randomly added to (or removed from) the latency.
+    :param failure_rate: The probability a command is silently dropped, as if it never arrived.
+    :param move_delay: Seconds each servo move takes (the firmware waits half a second).
+    :param temperature: The temperature reported, in Celsius.
+    :param link: If given, a symlink to the pseudo-terminal is kept at this path. Unlike the pseudo-terminal's own
+        name, it stays the same across ``unplug``/``plug``.
+    """
+    def __init__(self, latency=0, jitter=0, failure_rate=0, move_delay=0.5, temperature=25.0, link=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.move_delay = move_delay
+        self.temperature = temperature
+        self.link = link
+        self.eeprom = {CODE_GET_CLICK_POS: 120, CODE_GET_RELEASED_POS: 90, CODE_GET_CLICK2_POS: 255}
+        self.servo_pos = self.eeprom[CODE_GET_RELEASED_POS]
+        self.commands_count = 0
+        self.port = None
+        self._master = None
+        self._thread = None  # type: Thread
+        self._stop_event = Event()
+        self._lock = Lock()
+        self.plug()
+
+    def plug(self):
+        """Create the pseudo-terminal and start answering on it."""
+        import pty
+        import tty
+        with self._lock:
+            if self._master is not None:
+                return
+            master, slave = pty.openpty()
+            tty.setraw(slave)
+            self.port = os.ttyname(slave)
+            # The slave end is reopened by whoever connects, there's no need to hold it.
+            os.close(slave)
+            if self.link:
+                if os.path.lexists(self.link):
+                    os.remove(self.link)
+                os.symlink(self.port, self.link)
+            self._master = master
+            self._stop_event.clear()
+            self._thread = Thread(target=self._run, args=(master, ), name='Virtual clicker ({})'.format(self.port))
+            self._thread.daemon = True
+            self._thread.start()
+
+    def unplug(self):
+        """Make the clicker disappear, like pulling out its USB cable."""
+        with self._lock:
+            if self._master is None:
+                return
+            self._stop_event.set()
+            self._thread.join()
+            os.close(self._master)
+            self._master = None
+            if self.link and os.path.lexists(self.link):
+                os.remove(self.link)
+
+    close = unplug
+
+    def _run(self, master):
+        numbers = self._read_numbers(master)
+        while not self._stop_event.is_set():
+            try:
+                code = next(numbers)
+                if self.failure_rate and random.random() < self.failure_rate:
+                    continue
+                delay = self.latency + random.uniform(-self.jitter, self.jitter)
+                if delay > 0:
+                    time.sleep(delay)
+                self.commands_count += 1
+                reply = self._handle(code, numbers)
+            except StopIteration:
+                # Unplugged.
+                return
+            if reply is not None:
+                try:
+                    os.write(master, reply + '\r\n')
+                except OSError:
+                    # Nobody has the port open.
+                    pass
+
+    def _read_numbers(self, master):
+        """Yield the integers written to the port, parsed the way ``Serial.parseInt()`` does."""
+        import select
+        digits = ''
+        while not self._stop_event.is_set():
+            readable, _, _ = select.select([master], [], [], 0.1)
+            if not readable:
+                continue
+            try:
+                data = os.read(master, 1024)
+            except OSError:
+                # The other side isn't open (yet), wait for it.
+                time.sleep(0.1)
+                continue
+            for char in data:
+                if char.isdigit():
+                    digits += char
+                elif digits:
+                    yield int(digits)
+                    digits = ''
+
+    def _move(self, pos):
+        self.servo_pos = pos
+        if self.move_delay:
+            time.sleep(self.move_delay)
+
+    def _click(self, pos, release=255):
+        self._move(pos)
+        self._move(self.eeprom[CODE_GET_RELEASED_POS] if release == 255 else release)
+
+    def _handle(self, code, numbers):
+        in_range = lambda value: 0 <= value <= 180
+        if code in (CODE_GET_CLICK_POS, CODE_GET_RELEASED_POS, CODE_GET_CLICK2_POS):
+            return str(self.eeprom[code])
+        elif code in (CODE_SET_CLICK_POS, CODE_SET_RELEASED_POS, CODE_SET_CLICK2_POS):
+            value = next(numbers)
+            if in_range(value) or (code == CODE_SET_CLICK2_POS and value == 255):
+                # Each setter's code comes right after its getter's.
+                self.eeprom[code - 1] = value
+        elif code == CODE_GET_TEMPERATURE:
+            return '%.10f' % self.temperature
+        elif code == CODE_CLICK:
+            self._click(self.eeprom[CODE_GET_CLICK_POS])
+        elif code == CODE_CLICK2:
+            if in_range(self.eeprom[CODE_GET_CLICK2_POS]):
+                self._click(self.eeprom[CODE_GET_CLICK2_POS])
+        elif code == CODE_CUSTOM_CLICK:
+            click_pos, release_pos = next(numbers), next(numbers)
+            if in_range(click_pos) and in_range(release_pos):
+                self._click(click_pos, release_pos)
+        elif code == CODE_MOVE_CLICKER:
+            value = next(numbers)
+            if in_range(value):
+                self._move(value)
+        elif code == CODE_RESET_CLICKER:
+            self._move(self.eeprom[CODE_GET_RELEASED_POS])
+
+
+def main():
+    from optparse import OptionParser
+    parser = OptionParser(description='Run a virtual clicker on a pseudo-terminal until interrupted.')
+    parser.add_option('-l', '--latency', type='float', default=0, help='Seconds before handling each command.')
+    parser.add_option('-j', '--jitter', type='float', default=0, help='Random seconds added to the latency.')
+    parser.add_option('-f', '--failure-rate', type='float', default=0, help='Probability of dropping a command.')
+    parser.add_option('-m', '--move-delay', type='float', default=0.5, help='Seconds each servo move takes.')
+    parser.add_option('-t', '--temperature', type='float', default=25.0, help='Temperature to report.')
+    parser.add_option('--link', help='Keep a symlink to the pseudo-terminal at this path.')
+    options, _ = parser.parse_args()
+    clicker = VirtualClicker(options.latency, options.jitter, options.failure_rate, options.move_delay,
+                             options.temperature, options.link)
+    print 'Virtual clicker is listening on', options.link or clicker.port
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        clicker.close()
+
+
+if __name__ == '__main__':
+    main()
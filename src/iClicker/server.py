@@ -1,12 +1,25 @@
+import errno
 import hashlib
+import heapq
 import hmac
 import json
+import os
+import select
+import socket
 import time
+import traceback
+from collections import deque
 from SocketServer import *
-from threading import Thread, Event
+from Queue import Queue, Full
+from threading import Thread, Event, Lock
 
 from consts import *
-from settings import ServerSettings
+from protocol import MessageReader, encode_message, negotiate_codec, CODEC_JSON
+from schedules import AutoClickSchedule, DEFAULT_SCHEDULE_ID
+from futures import Future
+from serial_api import PRIORITY_CLICK, PRIORITY_TEMPERATURE, SERVO_MOVE_TIME, NoClickerError
+from settings import Settings, ServerSettings, ServerSettingsSnapshot
+from temperature_log import TemperatureLog
 
 
 class UDPBroadcastsHandler(DatagramRequestHandler):
@@ -14,7 +27,7 @@ class UDPBroadcastsHandler(DatagramRequestHandler):
         data = json.loads(self.rfile.read())
         code = data['code']
         if code == CODE_FIND_SERVER:
-            settings = ServerSettings()
+            settings = ServerSettingsSnapshot.current()
             self.wfile.write(json.dumps(dict(server_name=settings.server_name, port=settings.server_port)))
 
 
@@ -25,21 +38,38 @@ class BaseServerHandler(StreamRequestHandler):
 
     def setup(self):
         StreamRequestHandler.setup(self)
+        self._reader = MessageReader(self.request)
+        self._setup_protocol()
+
+    def _setup_protocol(self):
+        self._write_lock = Lock()
+        self._codec = CODEC_JSON
+        self._is_codec_announced = False
+        self.is_session = False
 
     def _post(self, code, **kwargs):
         kwargs['code'] = code
         kwargs['name'] = self.server.name
-        self.wfile.write(json.dumps(kwargs))
+        with self._write_lock:
+            if self._is_codec_announced:
+                self._write(encode_message(kwargs, self._codec))
+            else:
+                # The first message is always JSON, it tells the client which codec the rest will be in.
+                kwargs['codec'] = self._codec
+                self._write(encode_message(kwargs))
+                self._is_codec_announced = True
+
+    def _write(self, data):
+        self.request.sendall(data)
 
     def _get(self):
         try:
-            data = self.request.recv(1024)
+            data = self._reader.read()
         except socket.error as e:
-            if e.errno == socket.errno.EWOULDBLOCK:
+            if e.errno == errno.EWOULDBLOCK:
                 return None, None
             raise
         if data:
-            data = json.loads(data)
             return data['code'], data
         else:
             return None, None
@@ -55,21 +85,89 @@ class BaseServerHandler(StreamRequestHandler):
         code, data = self._get()
         if code is None:
             return
-        if self._challenge_sequence():
-            self._post(CODE_CHALLENGE_SUCCESS)
+        self._codec = negotiate_codec(data.get('codecs'))
+        password = ServerSettingsSnapshot.current().server_password
+        if self._has_valid_token(code, data, password):
+            # Authenticated by an earlier challenge, go straight to the request.
+            pass
+        elif self._challenge_sequence(password):
+            self._challenge_succeeded(password)
         else:
             self._post(CODE_CHALLENGE_FAILED)
             return
-        # Call the relevant handler
+        if code == CODE_OPEN_SESSION:
+            self.is_session = True
+            self._serve_session()
+            return
+        self._post(CODE_SERVER_RESPONSE, **self._call_handler(code, data))
+
+    def _call_handler(self, code, data):
+        """
+        :rtype: dict
+        """
+        if code == CODE_EVENTS_BATCH:
+            for event in data['events']:
+                self._call_handler(event['code'], event)
+            return {}
         handlers = {CODE_START_COMM: lambda **_: None}
         handlers.update(self.handlers())
         response = handlers[code](**data)
-        response = response or {}  # type: dict
-        self._post(CODE_SERVER_RESPONSE, **response)
+        return response or {}
+
+    def _serve_session(self):
+        """
+        Serve requests over this connection until the client closes it.
+
+        Each request carries a ``request_id``. Requests are handled concurrently and each response is sent back (with
+        the same ``request_id``) as soon as it's ready, so a slow request doesn't hold back the ones after it, and a
+        client may pipeline requests without waiting for their responses.
+        """
+        while True:
+            code, data = self._get()
+            if code is None:
+                return
+            thread = Thread(target=self._handle_session_request, args=(data, ))
+            thread.daemon = True
+            thread.start()
+
+    def _handle_session_request(self, data):
+        try:
+            response = self._call_handler(data['code'], data)
+        except Exception as error:
+            traceback.print_exc()
+            response = dict(error=str(error))
+        response['request_id'] = data['request_id']
+        try:
+            self._post(CODE_SERVER_RESPONSE, **response)
+        except (socket.error, ValueError):
+            # The session was closed in the meanwhile.
+            pass
 
-    def _challenge_sequence(self):
-        # Start authentication
-        password = ServerSettings().server_password
+    def post_event(self, code, kwargs):
+        """Stream an event down the session, unless the client stopped reading what was already sent."""
+        _, writable, _ = select.select([], [self.request], [], PUSH_TIMEOUT)
+        if not writable:
+            raise socket.timeout("{} isn't reading its session".format(self.client_address[0]))
+        self._post(code, **kwargs)
+
+    def _has_valid_token(self, code, data, password):
+        return code != CODE_OPEN_SESSION and \
+            self.server.session_tokens.is_valid(data.get('token'), self.client_address[0], password)
+
+    def _challenge_succeeded(self, password):
+        self._post(CODE_CHALLENGE_SUCCESS, token=self.server.session_tokens.issue(self.client_address[0], password),
+                   token_timeout=SESSION_TOKEN_TIMEOUT)
+
+    def _challenge_sequence(self, password):
+        expected_response = self._start_challenge(password)
+        code, result = self._get()
+        assert code == CODE_CHALLENGE_RESPONSE, code
+        return result['response'] == expected_response
+
+    def _start_challenge(self, password):
+        """
+        :return: The response expected to the challenge.
+        """
         if not password:
             # No challenge required.
             expected_response = None
@@ -79,13 +177,7 @@ class BaseServerHandler(StreamRequestHandler):
             password_hash = hashlib.sha1(password).hexdigest()
             expected_response = hmac.new(challenge, password_hash, hashlib.sha1).hexdigest()
             self._post(CODE_CHALLENGE_START, challenge=challenge)
-        code, result = self._get()
-        assert code == CODE_CHALLENGE_RESPONSE, code
-        response = result['response']
-        if response != expected_response:
-            return False
-        else:
-            return True
+        return expected_response
 
 
 class MainServerHandler(BaseServerHandler):
@@ -97,28 +189,37 @@ class MainServerHandler(BaseServerHandler):
             CODE_SET_AUTO_CLICKER: self.handle_set_auto_clicker,
             CODE_GET_SERVER_INFO: self.handle_get_server_info,
             CODE_GET_TEMPERATURE: self.handle_get_temperature,
+            CODE_GET_CLICKER_STATS: self.handle_get_clicker_stats,
+            CODE_GET_TEMPERATURE_HISTORY: self.handle_get_temperature_history,
+            CODE_SUBSCRIBE: self.handle_subscribe,
+            CODE_SET_AUTO_CLICK_SCHEDULE: self.handle_set_auto_click_schedule,
+            CODE_REMOVE_AUTO_CLICK_SCHEDULE: self.handle_remove_auto_click_schedule,
         }
 
-    def _extend_client_timeout(self):
-        client_port, old_update_time = self.server.clients[self.client_address[0]]
-        self.server.clients[self.client_address[0]] = (client_port, time.time())
+    def finish(self):
+        self.server.unsubscribe(self)
+        BaseServerHandler.finish(self)
 
-    def handle(self):
-        if self.client_address[0] in self.server.clients:
-            self._extend_client_timeout()
-        BaseServerHandler.handle(self)
+    def _call_handler(self, code, data):
+        self.server.clients.renew(self.client_address[0])
+        return BaseServerHandler._call_handler(self, code, data)
 
     def handle_start_comm(self, notifications_server_port=None, **_):
         if notifications_server_port:
-            self.server.clients[self.client_address[0]] = (notifications_server_port, None)
-            self._extend_client_timeout()
+            self.server.clients.register(self.client_address[0], notifications_server_port)
+
+    def handle_subscribe(self, **_):
+        if not self.is_session:
+            raise ValueError('Only a session can subscribe to events')
+        self.server.subscribe(self)
 
     def handle_say_hello(self, **_):
-        return dict(message='Hello from {}'.format(ServerSettings().server_name))
+        return dict(message='Hello from {}'.format(ServerSettingsSnapshot.current().server_name))
 
     def handle_click(self, name, **_):
+        # Answered once the clicker clicked, the outcome is pushed to all the clients.
         try:
-            self.server.click()
+            self.server.click().result()
         except NoClickerError as ex:
             self.server.push(CODE_SHOW_NOTIFICATION, title='Error!', message=str(ex))
         else:
@@ -136,23 +237,170 @@ class MainServerHandler(BaseServerHandler):
             self.server.push(CODE_SHOW_NOTIFICATION, title='Auto Clicker Stopped',
                              message="{} has disabled the auto clicker.".format(name))
 
+    def handle_set_auto_click_schedule(self, name, schedule, **_):
+        try:
+            schedule = AutoClickSchedule.from_dict(schedule)
+            self.server.set_auto_click_schedule(schedule)
+        except ValueError as error:
+            return dict(error=str(error))
+        self.server.push(CODE_SHOW_NOTIFICATION, title='Auto Clicker Schedule Set!',
+                         message="{} has set the auto clicker to click {}".format(name, _describe_schedule(schedule)))
+        return dict(schedule=schedule.to_dict())
+
+    def handle_remove_auto_click_schedule(self, name, schedule_id, **_):
+        if self.server.remove_auto_click_schedule(schedule_id):
+            self.server.push(CODE_SHOW_NOTIFICATION, title='Auto Clicker Schedule Removed',
+                             message="{} has removed an auto clicker schedule.".format(name))
+
     def handle_get_server_info(self, **_):
-        from time import time
-        return dict(
-            server_time=time(),
-            auto_clicker_interval=self.server.auto_clicker_interval,
-            auto_clicker_seconds_left_for_interval=self.server.auto_clicker_thread.seconds_left_for_interval
-            if self.server.auto_clicker_thread else None
-        )
+        return self.server.server_state()
 
     def handle_get_temperature(self, **_):
+        self.server.temperature_sampler.demand()
         return dict(temperature=self.server.temperature)
 
+    def handle_get_temperature_history(self, start=None, end=None, buckets=100, **_):
+        if self.server.temperature_log is None:
+            return dict(error="{} doesn't keep the temperature history".format(self.server.name))
+        buckets = min(buckets, TEMPERATURE_HISTORY_MAX_BUCKETS)
+        return dict(history=self.server.temperature_log.query(start, end, buckets))
+
+    def handle_get_clicker_stats(self, reset=False, **_):
+        stats = self.server.clicker_stats()
+        if reset:
+            self.server.reset_clicker_stats()
+        return dict(stats=stats)
+
+
+def _describe_schedule(schedule):
+    if schedule.cron is not None:
+        description = 'by the rule "{}"'.format(schedule.cron)
+    else:
+        description = 'every {} minutes'.format(schedule.interval)
+    return description if schedule.is_enabled else description + ' (disabled)'
+
+
+class SessionTokens(object):
+    """
+    Tokens handed out after successful challenges. A client presenting a valid one skips the challenge, until the token
+    expires or the password changes.
+    """
+    def __init__(self):
+        self._tokens = {}  # type: dict[str, tuple[str, str, float]]
+        self._lock = Lock()
+
+    def issue(self, client_ip, password):
+        token = os.urandom(16).encode('hex')
+        now = time.time()
+        with self._lock:
+            for expired_token in [key for key, (_, _, expiry) in self._tokens.iteritems() if expiry < now]:
+                del self._tokens[expired_token]
+            self._tokens[token] = (client_ip, password, now + SESSION_TOKEN_TIMEOUT)
+        return token
+
+    def is_valid(self, token, client_ip, password):
+        if not token:
+            return False
+        with self._lock:
+            entry = self._tokens.get(token)
+            if entry is None:
+                return False
+            token_client_ip, token_password, expiry = entry
+            if expiry < time.time():
+                del self._tokens[token]
+                return False
+        return token_client_ip == client_ip and token_password == password
+
+
+class ClientRegistry(object):
+    """
+    The clients that get the events on their notifications listener. Each has a lease, which is renewed by each of its
+    requests and expires ``timeout`` seconds after the last one.
+
+    ``snapshot`` is replaced rather than changed, so it can be read without the lock. The lease deadlines are kept in a
+    min-heap (renewals just push a new deadline, the outdated ones are skipped), so the background reaper only ever
+    looks at the leases that are due.
+    """
+    def __init__(self, timeout=SESSION_TIMEOUT):
+        self.timeout = timeout
+        self._leases = {}  # type: dict[str, tuple[int, float]]
+        self._deadlines = []  # type: list[tuple[float, str]]
+        self._snapshot = {}  # type: dict[str, int]
+        self._lock = Lock()
+        self._wake_event = Event()
+        self._stop_event = Event()
+        self._reaper = Thread(target=self._reap_forever, name='Client registry reaper')
+        self._reaper.daemon = True
+        self._reaper.start()
+
+    def __len__(self):
+        return len(self._snapshot)
+
+    def snapshot(self):
+        """
+        :return: The port of each registered client's listener, by its address. It must not be changed.
+        :rtype: dict[str, int]
+        """
+        return self._snapshot
+
+    def register(self, client_ip, port):
+        with self._lock:
+            self._lease(client_ip, port)
+            if self._snapshot.get(client_ip) != port:
+                snapshot = dict(self._snapshot)
+                snapshot[client_ip] = port
+                self._snapshot = snapshot
+
+    def renew(self, client_ip):
+        if client_ip not in self._snapshot:
+            return
+        with self._lock:
+            if client_ip in self._leases:
+                self._lease(client_ip, self._leases[client_ip][0])
+
+    def _lease(self, client_ip, port):
+        deadline = time.time() + self.timeout
+        self._leases[client_ip] = (port, deadline)
+        was_empty = not self._deadlines
+        heapq.heappush(self._deadlines, (deadline, client_ip))
+        if was_empty:
+            # The reaper has nothing to wait for, wake it up.
+            self._wake_event.set()
+
+    def _reap(self, now):
+        """
+        Drop the expired leases.
+
+        :return: When the next lease is due, None if there are none.
+        """
+        expired = []
+        while self._deadlines and self._deadlines[0][0] <= now:
+            deadline, client_ip = heapq.heappop(self._deadlines)
+            lease = self._leases.get(client_ip)
+            if lease is not None and lease[1] == deadline:
+                del self._leases[client_ip]
+                expired.append(client_ip)
+        if expired:
+            self._snapshot = dict((client_ip, port) for client_ip, (port, _) in self._leases.iteritems())
+        return self._deadlines[0][0] if self._deadlines else None
+
+    def _reap_forever(self):
+        while not self._stop_event.is_set():
+            with self._lock:
+                next_deadline = self._reap(time.time())
+                self._wake_event.clear()
+            self._wake_event.wait(None if next_deadline is None else max(0, next_deadline - time.time()))
+
+    def stop(self):
+        self._stop_event.set()
+        self._wake_event.set()
+
 
 class Server(ThreadingTCPServer):
     def __init__(self, name, server_address, handler=None):
         ThreadingTCPServer.__init__(self, server_address, handler)
         self.name = name
+        self.session_tokens = SessionTokens()
 
 
 class MainServer(Server):
@@ -160,79 +408,545 @@ class MainServer(Server):
         from serial_api import Clicker
 
         Server.__init__(self, server_name, server_address, handler=MainServerHandler)
-        self.clients = {}
+        ServerSettingsSnapshot.watch()
+        self.clients = ClientRegistry()
+        self.session_subscribers = frozenset()  # type: frozenset[MainServerHandler]
+        self._subscribers_lock = Lock()
         self.timeout = 5
-        self.auto_clicker_interval = None
-        self.auto_clicker_thread = None  # type: RepeatingThread
+        self.auto_click_schedules = {}  # type: dict[str, AutoClickSchedule]
+        self._auto_click_tasks = {}  # type: dict[str, ScheduledTask]
+        self._schedules_lock = Lock()
         self.temperature = None  # type: float
-        self.temperature_refresher_thread = RepeatingThread(20, self.update_temperature)
-        self.temperature_refresher_thread.start()
+        self.last_click_time = None  # type: float
         self._clicker = Clicker()
         self._is_last_clicked_on = False
-        self.update_temperature()
+        # Clicks submitted to the clicker's worker that weren't sent to the clicker yet.
+        self._pending_clicks = 0
+        self._pending_clicks_lock = Lock()
+        self.temperature_log = self._open_temperature_log()
+        self.scheduler = Scheduler()
+        self.scheduler.start()
+        self.temperature_sampler = TemperatureSampler(self, self.scheduler)
+        self._load_auto_click_schedules()
+        self.push_dispatcher = PushDispatcher(self.name)
+        self.push_window = PUSH_WINDOW
+        self._pending_events = []
+        self._push_task = None  # type: ScheduledTask
+        self._push_lock = Lock()
 
-    def push(self, code, **kwargs):
-        from client import Client
-        from datetime import datetime
-        for client_ip, (client_port, registration_time) in self.clients.items():
-            if (datetime.now() - datetime.fromtimestamp(registration_time)).total_seconds() > SESSION_TIMEOUT:
-                self.clients.pop(client_ip)
-                continue
+    @staticmethod
+    def _open_temperature_log():
+        """
+        A log that can't be read is kept aside (with a ``.bad`` suffix) and a new one is started. The history is
+        optional, so if there's still no log it's just off.
+
+        :return: The temperature log, None if the history is off.
+        :rtype: TemperatureLog
+        """
+        try:
+            path = Settings().data_file_path(TEMPERATURE_LOG_FILE_NAME)
             try:
-                client = Client(client_ip, client_port, password=ServerSettings().server_password,
-                                is_password_hashed=True, client_name=self.name)
-                client.send(code, **kwargs)
-            except:
-                pass
+                return TemperatureLog(path)
+            except IOError as error:
+                bad_path = path + '.bad'
+                print '{}, keeping it as {}'.format(error, bad_path)
+                if os.path.exists(bad_path):
+                    os.remove(bad_path)
+                os.rename(path, bad_path)
+                return TemperatureLog(path)
+        except (IOError, OSError) as error:
+            print 'The temperature history is off: {}'.format(error)
+            return None
+
+    def push(self, code, **kwargs):
+        """
+        Queue an event to all the subscribed clients, it's delivered in the background.
+
+        Events raised within ``push_window`` seconds of the first one are delivered together, in order.
+        """
+        with self._push_lock:
+            self._pending_events.append((code, kwargs))
+            if self._push_task is not None:
+                return
+            if self.push_window:
+                self._push_task = self.scheduler.schedule(self.push_window, self._flush_events)
+                return
+        self._flush_events()
+
+    def _flush_events(self):
+        with self._push_lock:
+            events, self._pending_events = self._pending_events, []
+            self._push_task = None
+        if not events:
+            return
+        subscribers = list(self.session_subscribers) + self.clients.snapshot().items()
+        self.push_dispatcher.push(subscribers, events)
+
+    def subscribe(self, handler):
+        """Stream the events down the session of the given handler, until it's closed."""
+        with self._subscribers_lock:
+            self.session_subscribers = self.session_subscribers | frozenset((handler, ))
+
+    def unsubscribe(self, handler):
+        with self._subscribers_lock:
+            self.session_subscribers = self.session_subscribers - frozenset((handler, ))
+
+    @property
+    def auto_clicker_interval(self):
+        """The interval of the single interval auto clicker (the default schedule), in minutes."""
+        schedule = self.auto_click_schedules.get(DEFAULT_SCHEDULE_ID)
+        return schedule.interval if schedule is not None and schedule.is_enabled else None
 
     def set_auto_clicker(self, interval):
         assert isinstance(interval, (int, type(None)))
-        self.auto_clicker_interval = interval
-        if self.auto_clicker_thread:
-            self.auto_clicker_thread.stop_event.set()
-        if interval is not None:
-            interval *= 60
-            self.auto_clicker_thread = RepeatingThread(interval, self.click)
-            self.auto_clicker_thread.start()
-        self.push(CODE_AUTO_CLICKER_CHANGED, new_interval=interval)
-
-    def click(self):
+        if interval is None:
+            self.remove_auto_click_schedule(DEFAULT_SCHEDULE_ID)
+        else:
+            self.set_auto_click_schedule(AutoClickSchedule(DEFAULT_SCHEDULE_ID, interval=interval))
+
+    def set_auto_click_schedule(self, schedule):
+        """Add the schedule, or replace the one with the same ID."""
+        with self._schedules_lock:
+            # Armed first, so a schedule that can't be armed isn't kept.
+            self._arm_auto_click_schedule(schedule)
+            self.auto_click_schedules[schedule.schedule_id] = schedule
+            self._save_auto_click_schedules()
+        self.push(CODE_AUTO_CLICKER_CHANGED, **self.server_state())
+
+    def remove_auto_click_schedule(self, schedule_id):
+        """
+        :return: Whether there was such a schedule.
+        :rtype: bool
+        """
+        with self._schedules_lock:
+            if self.auto_click_schedules.pop(schedule_id, None) is None:
+                return False
+            task = self._auto_click_tasks.pop(schedule_id, None)
+            if task is not None:
+                task.cancel()
+            self._save_auto_click_schedules()
+        self.push(CODE_AUTO_CLICKER_CHANGED, **self.server_state())
+        return True
+
+    def _load_auto_click_schedules(self):
+        try:
+            saved_schedules = ServerSettings().auto_click_schedules
+        except ValueError as error:
+            print 'Dropping the saved auto click schedules: {}'.format(error)
+            saved_schedules = []
+        with self._schedules_lock:
+            for data in saved_schedules:
+                try:
+                    schedule = AutoClickSchedule.from_dict(data)
+                    self._arm_auto_click_schedule(schedule)
+                except ValueError as error:
+                    print 'Dropping auto click schedule {!r}: {}'.format(data, error)
+                    continue
+                self.auto_click_schedules[schedule.schedule_id] = schedule
+
+    def _save_auto_click_schedules(self):
+        ServerSettings().auto_click_schedules = [schedule.to_dict()
+                                                 for schedule in self.auto_click_schedules.itervalues()]
+
+    def _arm_auto_click_schedule(self, schedule):
+        """Schedule the next click of the schedule (none if it's disabled). Called with the schedules lock held."""
+        next_fire_time = schedule.next_fire_time()
+        task = self._auto_click_tasks.pop(schedule.schedule_id, None)
+        if task is not None:
+            task.cancel()
+        if next_fire_time is not None:
+            self._auto_click_tasks[schedule.schedule_id] = self.scheduler.schedule(
+                next_fire_time - time.time(), self._auto_click, schedule)
+
+    def _auto_click(self, schedule):
+        with self._schedules_lock:
+            if self.auto_click_schedules.get(schedule.schedule_id) is not schedule:
+                # Replaced or removed while it was due.
+                return
+            self._arm_auto_click_schedule(schedule)
+        # Not waited for, the scheduler's other tasks shouldn't wait for the servo.
+        self.click(is_auto_click=True).add_done_callback(self._auto_clicked)
+
+    def _auto_clicked(self, future):
+        try:
+            future.result()
+        except NoClickerError as error:
+            self.push(CODE_SHOW_NOTIFICATION, title='Error!', message=str(error))
+
+    def _restart_auto_clicker_interval(self):
+        """
+        Count the interval of the auto clicker (the default schedule) from now. The other schedules keep their own
+        times. It isn't saved, so a restart counts from the time the schedule was set, as before the click.
+        """
+        with self._schedules_lock:
+            schedule = self.auto_click_schedules.get(DEFAULT_SCHEDULE_ID)
+            if schedule is None or schedule.interval is None or not schedule.is_enabled:
+                return
+            schedule.start_time = time.time()
+            self._arm_auto_click_schedule(schedule)
+
+    def server_state(self):
+        """
+        What the clients show about the server. It's sent as the server info, and along with the events that change it
+        so the clients don't have to ask for it.
+
+        :rtype: dict
+        """
+        with self._schedules_lock:
+            schedules = [dict(schedule.to_dict(), next_fire_time=self._auto_click_tasks[schedule.schedule_id].deadline
+                              if schedule.schedule_id in self._auto_click_tasks else None)
+                         for schedule in self.auto_click_schedules.itervalues()]
+            default_task = self._auto_click_tasks.get(DEFAULT_SCHEDULE_ID)
+            seconds_left = default_task.seconds_left() if default_task is not None else None
+        return dict(
+            server_time=time.time(),
+            auto_clicker_interval=self.auto_clicker_interval,
+            auto_clicker_seconds_left_for_interval=int(seconds_left) if seconds_left is not None else None,
+            auto_click_schedules=schedules,
+            last_click_time=self.last_click_time,
+            temperature=self.temperature,
+        )
+
+    def click(self, is_auto_click=False):
+        """
+        Click on the clicker's worker, without waiting for it. The clients are told once it clicked.
+
+        :return: The future of the click, it fails with ``NoClickerError`` if the clicker couldn't click.
+        :rtype: Future
+        """
         import datetime
         print 'Click', datetime.datetime.now()
-        if self.auto_clicker_thread:
-            self.auto_clicker_thread.seconds_left_for_interval = self.auto_clicker_thread.interval
+        if not is_auto_click:
+            # A click starts the auto clicker's interval over.
+            self._restart_auto_clicker_interval()
+        with self._pending_clicks_lock:
+            self._pending_clicks += 1
+        clicked = Future()
+        self._clicker.submit(PRIORITY_CLICK, self._click).add_done_callback(
+            lambda future: self._clicked(future, clicked))
+        return clicked
+
+    def _clicked(self, future, clicked):
+        self.last_click_time = time.time()
+        with self._pending_clicks_lock:
+            self._pending_clicks -= 1
         try:
-            if self._clicker.is_click2_enabled():
-                if self._is_last_clicked_on:
-                    self._clicker.click2()
-                    self._is_last_clicked_on = False
-                else:
-                    self._clicker.click()
-                    self._is_last_clicked_on = True
+            future.result()
+        except Exception:
+            error = NoClickerError("Error communicating with the clicker. It's possible it's not connected.")
+            clicked.set_exception((NoClickerError, error, None))
+            return
+        self.push(CODE_CLICK_HAPPENED, **self.server_state())
+        clicked.set_result(None)
+
+    def _click(self):
+        # Runs on the clicker's worker, so clicks from several threads can't interleave.
+        if self._clicker.is_click2_enabled():
+            if self._is_last_clicked_on:
+                self._clicker.click2()
+                self._is_last_clicked_on = False
             else:
                 self._clicker.click()
-        except:
-            raise NoClickerError("Error communicating with the clicker. It's possible it's not connected.")
+                self._is_last_clicked_on = True
         else:
-            self.push(CODE_CLICK_HAPPENED)
+            self._clicker.click()
+
+    def clicker_stats(self):
+        stats = self._clicker.stats.snapshot()
+        stats['connected'] = self._clicker.is_connected()
+        return stats
+
+    def reset_clicker_stats(self):
+        self._clicker.stats.reset()
+
+    def seconds_until_clicker_idle(self):
+        """How long until the servo is surely done with the clicks sent to the clicker, and the ones still on its way."""
+        now = time.time()
+        idle_time = self._clicker.idle_time()
+        if self._pending_clicks:
+            # They click after whatever the clicker is doing now, two moves each.
+            idle_time = max(idle_time, now) + self._pending_clicks * 2 * SERVO_MOVE_TIME
+        return max(0, idle_time + CLICK_QUIET_PERIOD - now)
+
+    def sample_temperature(self):
+        """
+        Update the temperature on the clicker's worker, after the clicks waiting for it. The sample is logged on the
+        scheduler's thread, so the clicks don't wait for the log either.
+
+        :return: The future of the update.
+        :rtype: Future
+        """
+        future = self._clicker.submit(PRIORITY_TEMPERATURE, self.update_temperature)
+        future.add_done_callback(self._temperature_sampled)
+        return future
 
     def update_temperature(self):
+        """:return: The temperature, None if the clicker couldn't tell."""
         try:
             self.temperature = self._clicker.temperature
         except:
             self.temperature = None
+        return self.temperature
+
+    def _temperature_sampled(self, future):
+        temperature = future.result()
+        if temperature is not None:
+            self.scheduler.schedule(0, self._log_temperature, temperature, time.time())
+
+    def _log_temperature(self, temperature, timestamp):
+        if self.temperature_log is None:
+            return
+        try:
+            self.temperature_log.append(temperature, timestamp)
+        except (IOError, OSError) as error:
+            print error
 
     def server_close(self):
-        if self.auto_clicker_thread:
-            self.auto_clicker_thread.stop_event.set()
-            self.auto_clicker_thread.join()
-        if self.temperature_refresher_thread:
-            self.temperature_refresher_thread.stop_event.set()
-            self.temperature_refresher_thread.join()
+        self.scheduler.stop()
+        self.scheduler.join()
+        with self._push_lock:
+            if self._push_task is not None:
+                self._push_task.cancel()
+        self.push_dispatcher.stop()
+        self.clients.stop()
+        self._clicker.close()
+        if self.temperature_log is not None:
+            self.temperature_log.close()
         Server.server_close(self)
 
 
+class PoolMixIn:
+    """
+    Handle the connections on a fixed pool of threads, rather than a new thread each.
+
+    Connections wait for a thread in a bounded queue, and once it's full the new ones are turned away right away with a
+    ``CODE_SERVER_BUSY``, as are the ones that waited longer than ``queue_timeout``. So the threads and memory stay the
+    same however many clients connect at once. Sessions don't keep a thread, once a session is open it's handed to the
+    ``SessionReader`` and its requests are queued for the pool like the connections are.
+    """
+    pool_size = POOL_WORKERS
+    queue_size = POOL_QUEUE_SIZE
+    queue_timeout = POOL_QUEUE_TIMEOUT
+
+    def _setup_pool(self):
+        self._jobs = Queue(self.queue_size)
+        self._pool = []
+        self.session_reader = SessionReader(self)
+
+    def _start_pool(self):
+        for index in xrange(self.pool_size):
+            thread = Thread(target=self._work, name='Server worker #{}'.format(index))
+            thread.daemon = True
+            thread.start()
+            self._pool.append(thread)
+        self.session_reader.start()
+
+    def submit(self, method, *args):
+        """
+        Run ``method(*args)`` on the pool.
+
+        :return: Whether it was queued, it isn't if the queue is full.
+        :rtype: bool
+        """
+        try:
+            self._jobs.put_nowait((method, args))
+        except Full:
+            return False
+        return True
+
+    def process_request(self, request, client_address):
+        if not self.submit(self._serve_request, request, client_address, time.time()):
+            self.reject_request(request, client_address)
+
+    def reject_request(self, request, client_address):
+        try:
+            request.sendall(encode_message(dict(code=CODE_SERVER_BUSY, name=self.name)))
+        except socket.error:
+            pass
+        self.shutdown_request(request)
+
+    def _serve_request(self, request, client_address, queued_time):
+        if time.time() - queued_time > self.queue_timeout:
+            self.reject_request(request, client_address)
+            return
+        handler = None
+        try:
+            handler = self.RequestHandlerClass(request, client_address, self)
+        except Exception:
+            self.handle_error(request, client_address)
+        if handler is None or not handler.is_session:
+            self.shutdown_request(request)
+
+    def _work(self):
+        for method, args in iter(self._jobs.get, None):
+            try:
+                method(*args)
+            except Exception:
+                traceback.print_exc()
+
+    def _stop_pool(self):
+        self.session_reader.stop()
+        for _ in self._pool:
+            try:
+                self._jobs.put_nowait(None)
+            except Full:
+                # The workers are daemons, they won't hold the process anyway.
+                break
+
+
+class PoolMainServerHandler(MainServerHandler):
+    """The handlers of the pool engine, where open sessions are read by the ``SessionReader``."""
+    def _serve_session(self):
+        self.server.session_reader.add(self)
+
+    def finish(self):
+        if self.is_session:
+            # The session outlives this call, its requests (a subscription among them) may already be handled on the
+            # pool. The ``SessionReader`` unsubscribes it once it's closed.
+            BaseServerHandler.finish(self)
+            return
+        MainServerHandler.finish(self)
+
+    def read_session_requests(self, receive=True):
+        """
+        Read what arrived on the session, once it's readable.
+
+        :param receive: False to only take the requests that were already received, without reading the socket.
+        :return: The requests that arrived whole, None if the session was closed.
+        :rtype: list[dict]
+        """
+        try:
+            if receive and not self._reader.fill():
+                return None
+            return list(iter(self._reader.read_buffered, None))
+        except (socket.error, ValueError):
+            return None
+
+    def submit_session_request(self, data):
+        if not self.server.submit(self._handle_session_request, data):
+            self._post(CODE_SERVER_RESPONSE, request_id=data['request_id'],
+                       error='{} is too busy, try again later'.format(self.server.name))
+
+
+class SessionReader(Thread):
+    """
+    Reads the requests of all the open sessions of a pool server on a single thread, so an idle session doesn't hold
+    one of the pool's threads. The requests are handled on the pool.
+    """
+    def __init__(self, server):
+        Thread.__init__(self, name='Session reader')
+        self.daemon = True
+        self.server = server  # type: PoolMainServer
+        self._sessions = {}  # type: dict[int, PoolMainServerHandler]
+        self._new_sessions = []
+        self._lock = Lock()
+        self._is_stopped = False
+        self._wake_up_socket = WakeUpSocket()
+        self._poller = select.poll() if hasattr(select, 'poll') else None
+        self._watch(self._wake_up_socket.fileno())
+
+    def add(self, handler):
+        """Read the requests of the handler's session from now on, until it's closed."""
+        with self._lock:
+            self._new_sessions.append(handler)
+        self._wake_up_socket.wake()
+
+    def _watch(self, fileno):
+        if self._poller is not None:
+            self._poller.register(fileno, select.POLLIN)
+
+    def _wait(self):
+        """:return: The readable file descriptors."""
+        if self._poller is not None:
+            return [fileno for fileno, _ in self._poller.poll()]
+        return select.select([self._wake_up_socket.fileno()] + self._sessions.keys(), [], [])[0]
+
+    def run(self):
+        while not self._is_stopped:
+            with self._lock:
+                new_sessions, self._new_sessions = self._new_sessions, []
+            for handler in new_sessions:
+                self._sessions[handler.request.fileno()] = handler
+                self._watch(handler.request.fileno())
+                # Requests sent right after the session was opened may have been received along with it.
+                self._read(handler, receive=False)
+            for fileno in self._wait():
+                if fileno == self._wake_up_socket.fileno():
+                    self._wake_up_socket.clear()
+                elif fileno in self._sessions:
+                    self._read(self._sessions[fileno])
+        for handler in self._sessions.values():
+            self._close(handler)
+        self._wake_up_socket.close()
+
+    def _read(self, handler, receive=True):
+        requests = handler.read_session_requests(receive)
+        if requests is None:
+            self._close(handler)
+            return
+        for data in requests:
+            handler.submit_session_request(data)
+
+    def _close(self, handler):
+        fileno = handler.request.fileno()
+        del self._sessions[fileno]
+        if self._poller is not None:
+            self._poller.unregister(fileno)
+        self.server.unsubscribe(handler)
+        self.server.shutdown_request(handler.request)
+
+    def stop(self):
+        self._is_stopped = True
+        self._wake_up_socket.wake()
+
+
+class PoolMainServer(PoolMixIn, MainServer):
+    def __init__(self, server_name, server_address):
+        self._setup_pool()
+        MainServer.__init__(self, server_name, server_address)
+        self.RequestHandlerClass = PoolMainServerHandler
+        self._start_pool()
+
+    def server_close(self):
+        MainServer.server_close(self)
+        self._stop_pool()
+
+
+class WakeUpSocket(object):
+    """
+    A socket that becomes readable whenever ``wake`` is called, to wake up a thread waiting on it along with other
+    sockets. It's a pair of connected sockets made in a way that works on Windows too.
+    """
+    def __init__(self):
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(1)
+        self._writer = socket.create_connection(listener.getsockname())
+        self._writer.setblocking(False)
+        self.reader, _ = listener.accept()
+        listener.close()
+
+    def fileno(self):
+        return self.reader.fileno()
+
+    def wake(self):
+        try:
+            self._writer.send('x')
+        except socket.error:
+            # The buffer is full, so there are plenty of wake ups waiting already.
+            pass
+
+    def clear(self):
+        """Take the wake ups so far, so the socket isn't readable until the next one."""
+        self.reader.recv(4096)
+
+    def close(self):
+        self.reader.close()
+        self._writer.close()
+
+
 def answer_search_requests(threaded=True):
+    ServerSettingsSnapshot.watch()
     try:
         server = ThreadingUDPServer(('0.0.0.0', SERVER_BROADCAST_PORT), UDPBroadcastsHandler)
     except socket.error as error:
@@ -241,10 +955,16 @@ def answer_search_requests(threaded=True):
     return _init_server(server, threaded)
 
 
-def run_server(threaded=True):
+def run_server(threaded=True, engine=ENGINE_THREADS):
+    if engine == ENGINE_ASYNC:
+        from async_server import AsyncMainServer as server_class
+    elif engine == ENGINE_POOL:
+        server_class = PoolMainServer
+    else:
+        server_class = MainServer
     try:
         settings = ServerSettings()
-        server = MainServer(settings.server_name, ('0.0.0.0', settings.server_port))
+        server = server_class(settings.server_name, ('0.0.0.0', settings.server_port))
     except socket.error as error:
         print error
         return None
@@ -261,29 +981,232 @@ def _init_server(server, threaded=True):
         server.serve_forever()
 
 
-class RepeatingThread(Thread):
-    def __init__(self, interval_in_seconds, method):
-        super(RepeatingThread, self).__init__()
-        interval_in_seconds = int(interval_in_seconds)
-        if interval_in_seconds < 1:
-            interval_in_seconds = 1
-        self.stop_event = Event()
-        self.interval = interval_in_seconds
-        self.seconds_left_for_interval = self.interval - 1
+class PushDispatcher(object):
+    """
+    Delivers events to subscribers from a fixed pool of threads.
+
+    A subscriber is either the (address, port) of a client's notifications listener, which is connected to for each
+    event, or the handler of a subscribed session, which the events are streamed down.
+
+    Each subscriber has its own queue of up to ``PUSH_QUEUE_SIZE`` events (the oldest are dropped when a slow subscriber
+    falls behind) and is served by one thread at a time, so its events arrive in order, while the other subscribers are
+    served in parallel. Whatever piled up in a subscriber's queue by the time a thread gets to it is delivered at once,
+    as a ``CODE_EVENTS_BATCH``. A delivery that doesn't finish within ``PUSH_TIMEOUT`` fails, and a subscriber that fails
+    loses the rest of its queue, so a dead subscriber holds up at most one thread for a while.
+    """
+    def __init__(self, name, workers=PUSH_WORKERS):
+        self.name = name
+        self._queues = {}  # type: dict[tuple[str, int] | BaseServerHandler, deque]
+        self._ready = Queue()
+        self._lock = Lock()
+        self._workers = [Thread(target=self._run, name='Push dispatcher #{}'.format(index))
+                         for index in xrange(workers)]
+        for worker in self._workers:
+            worker.daemon = True
+            worker.start()
+
+    def push(self, subscribers, events):
+        """
+        :type subscribers: list[tuple[str, int] | BaseServerHandler]
+        :param events: The (code, kwargs) of each event, in order.
+        """
+        with self._lock:
+            for subscriber in subscribers:
+                queue = self._queues.get(subscriber)
+                if queue is None:
+                    # A subscriber without a queue isn't waiting for a thread yet.
+                    queue = self._queues[subscriber] = deque(maxlen=PUSH_QUEUE_SIZE)
+                    self._ready.put(subscriber)
+                queue.extend(events)
+
+    def _run(self):
+        for subscriber in iter(self._ready.get, None):
+            with self._lock:
+                events = list(self._queues[subscriber])
+                self._queues[subscriber].clear()
+            if len(events) == 1:
+                code, kwargs = events[0]
+            else:
+                code, kwargs = CODE_EVENTS_BATCH, dict(events=[dict(event_kwargs, code=event_code)
+                                                          for event_code, event_kwargs in events])
+            is_delivered = self._deliver(subscriber, code, kwargs)
+            with self._lock:
+                queue = self._queues[subscriber]
+                if queue and is_delivered:
+                    # Back of the line, so a busy subscriber doesn't starve the others.
+                    self._ready.put(subscriber)
+                else:
+                    del self._queues[subscriber]
+
+    def _deliver(self, subscriber, code, kwargs):
+        if isinstance(subscriber, BaseServerHandler):
+            try:
+                subscriber.post_event(code, kwargs)
+            except (socket.error, select.error, ValueError):
+                return False
+            return True
+        from client import Client
+        client = Client(subscriber[0], subscriber[1], password=ServerSettingsSnapshot.current().server_password,
+                        is_password_hashed=True, client_name=self.name, timeout=PUSH_TIMEOUT)
+        try:
+            client.send(code, **kwargs)
+        except Exception:
+            return False
+        finally:
+            client.close()
+        return True
+
+    def stop(self):
+        for _ in self._workers:
+            self._ready.put(None)
+
+
+class ScheduledTask(object):
+    """A method the ``Scheduler`` runs once when it's due. A task that repeats reschedules itself when it runs."""
+    def __init__(self, scheduler, method, args, kwargs):
         self.method = method
+        self.args = args
+        self.kwargs = kwargs
+        self.deadline = None  # type: float
+        self._scheduler = scheduler  # type: Scheduler
+
+    def seconds_left(self):
+        """:rtype: float"""
+        deadline = self.deadline
+        return None if deadline is None else max(0, deadline - time.time())
+
+    def reschedule(self, delay):
+        """Run in ``delay`` seconds from now instead, or again if it already ran."""
+        self._scheduler.reschedule(self, time.time() + delay)
+
+    def cancel(self):
+        self._scheduler.reschedule(self, None)
+
+
+class Scheduler(Thread):
+    """
+    Runs the timed tasks of the server on a single thread, which sleeps until the next one is due.
+
+    The deadlines are kept in a min-heap. Rescheduling or cancelling a task just pushes its new deadline (or nothing),
+    the outdated ones are skipped when they come up. The tasks run one at a time, so they should be short.
+    """
+    def __init__(self):
+        super(Scheduler, self).__init__(name='Scheduler')
+        self.daemon = True
+        self._deadlines = []  # type: list[tuple[float, int, ScheduledTask]]
+        self._counter = 0
+        self._lock = Lock()
+        self._wake_event = Event()
+        self._stop_event = Event()
+
+    def schedule(self, delay, method, *args, **kwargs):
+        """
+        Run the method with the given arguments in ``delay`` seconds.
+
+        :rtype: ScheduledTask
+        """
+        task = ScheduledTask(self, method, args, kwargs)
+        self.reschedule(task, time.time() + delay)
+        return task
+
+    def reschedule(self, task, deadline):
+        """Move the task to run at the given time, None cancels it."""
+        with self._lock:
+            task.deadline = deadline
+            if deadline is None:
+                return
+            # The counter keeps the heap from comparing tasks with the same deadline.
+            self._counter += 1
+            heapq.heappush(self._deadlines, (deadline, self._counter, task))
+            is_first = self._deadlines[0][2] is task
+        if is_first:
+            self._wake_event.set()
+
+    def _next_due(self, now):
+        """
+        :return: The next task that's due, if there is one, otherwise when the next one is (None if there are none).
+        :rtype: tuple[ScheduledTask, float]
+        """
+        with self._lock:
+            while self._deadlines:
+                deadline, _, task = self._deadlines[0]
+                if task.deadline != deadline:
+                    heapq.heappop(self._deadlines)
+                elif deadline > now:
+                    self._wake_event.clear()
+                    return None, deadline
+                else:
+                    heapq.heappop(self._deadlines)
+                    task.deadline = None
+                    return task, None
+            self._wake_event.clear()
+            return None, None
 
     def run(self):
-        while not self.stop_event.wait(1):
-            if self.seconds_left_for_interval > 0:
-                self.seconds_left_for_interval -= 1
-            else:
-                self.seconds_left_for_interval = self.interval - 1
-                self.method()
+        while not self._stop_event.is_set():
+            task, next_deadline = self._next_due(time.time())
+            if task is not None:
+                try:
+                    task.method(*task.args, **task.kwargs)
+                except Exception:
+                    traceback.print_exc()
+                continue
+            self._wake_event.wait(None if next_deadline is None else max(0, next_deadline - time.time()))
+
+    def stop(self):
+        self._stop_event.set()
+        self._wake_event.set()
+
+
+class TemperatureSampler(object):
+    """
+    Samples the clicker's temperature as often as it's needed: every ``TEMPERATURE_ACTIVE_INTERVAL`` while there are
+    subscribed clients, recent temperature requests, or the temperature is moving; otherwise backing off up to
+    ``TEMPERATURE_IDLE_INTERVAL``. Samples are postponed until the servo is done with the last click.
+    """
+    def __init__(self, server, scheduler):
+        self.server = server  # type: MainServer
+        self.interval = 0
+        self._last_demand_time = None
+        self._task = scheduler.schedule(0, self._sample)
+
+    def demand(self):
+        """Note that someone asked for the temperature, sample right away if the sampler is backing off."""
+        now = time.time()
+        was_in_demand = self._is_in_demand(now)
+        self._last_demand_time = now
+        if not was_in_demand:
+            self._task.reschedule(0)
+
+    def _is_in_demand(self, now):
+        return bool(self.server.clients or self.server.session_subscribers) or \
+            (self._last_demand_time is not None and now - self._last_demand_time < TEMPERATURE_DEMAND_WINDOW)
+
+    def _next_interval(self, previous_temperature, temperature):
+        is_moving = previous_temperature is not None and temperature is not None and \
+            abs(temperature - previous_temperature) >= TEMPERATURE_CHANGE_THRESHOLD
+        if is_moving or self._is_in_demand(time.time()):
+            return TEMPERATURE_ACTIVE_INTERVAL
+        return min(max(self.interval, TEMPERATURE_ACTIVE_INTERVAL) * 2, TEMPERATURE_IDLE_INTERVAL)
+
+    def _sample(self):
+        seconds_until_idle = self.server.seconds_until_clicker_idle()
+        if seconds_until_idle > 0:
+            self.interval = seconds_until_idle
+            self._task.reschedule(self.interval)
+            return
+        # The next sample is scheduled once this one is done, the scheduler doesn't wait for the clicker.
+        previous_temperature = self.server.temperature
+        self.server.sample_temperature().add_done_callback(lambda _: self._sampled(previous_temperature))
+
+    def _sampled(self, previous_temperature):
+        self.interval = self._next_interval(previous_temperature, self.server.temperature)
+        self._task.reschedule(self.interval)
+
+    def stop(self):
+        self._task.cancel()
 
 
 if __name__ == '__main__':
     answer_search_requests(True)
     run_server(False)
-
-
-class NoClickerError(Exception): pass
\ No newline at end of file
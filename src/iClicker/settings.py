@@ -1,25 +1,81 @@
+import atexit
+import json
+import os
+import sys
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from threading import Thread, Lock, RLock, Timer
+
 from PySide.QtCore import QSettings
 
-from ClickerGUI import SOFTWARE_NAME
 from consts import *
 
 
 class Settings(QSettings):
+    """
+    The settings of the whole process (a single object).
+
+    Reads come from memory. The file is read again only after another process changed it, which is noticed by its
+    modification time (checked at most every ``SETTINGS_WATCH_INTERVAL`` seconds). Writes are saved together,
+    ``SETTINGS_FLUSH_DELAY`` seconds after the first one, or when the outermost ``batch`` ends.
+
+    The settings are always kept in an INI file, never in the registry (QSettings' native format on Windows), which has
+    no modification time to notice the other process' changes by.
+    """
     _singleton_object = None
 
     def __new__(cls):
         if cls._singleton_object is None:
-            instance = QSettings.__new__(cls)
-            Settings.__init__(instance)
-            cls._singleton_object = instance
+            cls.use_file(None)
         return cls._singleton_object
 
-    def __init__(self):
+    def __init__(self, file_name=None):
         if Settings._singleton_object is self:
             return
-        super(Settings, self).__init__(QSettings.UserScope, SOFTWARE_NAME, SOFTWARE_NAME)
+        if file_name is None:
+            super(Settings, self).__init__(QSettings.IniFormat, QSettings.UserScope, SOFTWARE_NAME, SOFTWARE_NAME)
+            self._import_native_settings()
+            self._data_directory = _user_data_directory()
+        else:
+            super(Settings, self).__init__(file_name, QSettings.IniFormat)
+            self._data_directory = os.path.dirname(os.path.abspath(file_name))
         self.setIniCodec('UTF-8')
         self.setFallbacksEnabled(False)
+        self._lock = RLock()
+        self._batch_depth = 0
+        self._is_dirty = False
+        self._flush_timer = None  # type: Timer
+        self._modification_time = self.file_modification_time()
+        self._last_check_time = time.time()
+        atexit.register(self.flush)
+
+    @classmethod
+    def use_file(cls, file_name):
+        """
+        Keep the settings of the process in the given INI file from now on (e.g. in tests), or in the user's settings
+        if it's None. The data files are kept next to the given file, or in the user's data directory.
+
+        :rtype: Settings
+        """
+        if cls._singleton_object is not None:
+            cls._singleton_object.flush()
+        instance = QSettings.__new__(cls)
+        Settings.__init__(instance, file_name)
+        cls._singleton_object = instance
+        return instance
+
+    def _import_native_settings(self):
+        """Copy the settings that earlier versions kept in the native format, the first time the INI file is used."""
+        if os.path.exists(self.fileName()):
+            return
+        native_settings = QSettings(QSettings.NativeFormat, QSettings.UserScope, SOFTWARE_NAME, SOFTWARE_NAME)
+        keys = native_settings.allKeys()
+        if not keys:
+            return
+        for key in keys:
+            QSettings.setValue(self, key, native_settings.value(key))
+        QSettings.sync(self)
 
     @property
     def mode(self):
@@ -30,28 +86,104 @@ class Settings(QSettings):
         self.setValue("run_mode", value)
 
     def setValue(self, *args, **kwargs):
-        QSettings.setValue(self, *args, **kwargs)
-        self.sync()
+        with self._lock:
+            QSettings.setValue(self, *args, **kwargs)
+            self._is_dirty = True
+            if not self._batch_depth and self._flush_timer is None:
+                self._flush_timer = Timer(SETTINGS_FLUSH_DELAY, self._flush_unless_batched)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
 
     def value(self, *args, **kwargs):
+        with self._lock:
+            self._reload_if_changed()
+            return QSettings.value(self, *args, **kwargs)
+
+    @contextmanager
+    def batch(self):
+        """Save all the writes made inside at once, when the (outermost) batch ends."""
+        with self._lock:
+            self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._batch_depth -= 1
+                if not self._batch_depth:
+                    self.flush()
+
+    def flush(self):
+        """Save the pending writes now."""
+        with self._lock:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+            if self._is_dirty:
+                self._sync()
+
+    def _flush_unless_batched(self):
+        with self._lock:
+            self._flush_timer = None
+            if not self._batch_depth:
+                self.flush()
+
+    def reload_from_disk(self):
+        """Read the file again now (saving the pending writes first), even if it was just checked."""
+        with self._lock:
+            self._last_check_time = time.time()
+            self._sync()
+
+    def _reload_if_changed(self):
+        now = time.time()
+        if now - self._last_check_time < SETTINGS_WATCH_INTERVAL:
+            return
+        self._last_check_time = now
+        if self.file_modification_time() != self._modification_time:
+            # Saves the pending writes as well.
+            self._sync()
+
+    def _sync(self):
         self.sync()
-        return QSettings.value(self, *args, **kwargs)
+        self._is_dirty = False
+        self._modification_time = self.file_modification_time()
+
+    def file_modification_time(self):
+        try:
+            return os.path.getmtime(self.fileName())
+        except OSError:
+            return None
+
+    def data_file_path(self, file_name):
+        """A path for a data file of the given name, in the data directory (which is created if needed)."""
+        if not os.path.isdir(self._data_directory):
+            os.makedirs(self._data_directory)
+        return os.path.join(self._data_directory, file_name)
+
+
+def _user_data_directory():
+    """The user's directory for the software's data files, e.g. %APPDATA%\\iClicker on Windows."""
+    if sys.platform == 'win32':
+        base = os.environ.get('APPDATA') or os.path.expanduser('~')
+    elif sys.platform == 'darwin':
+        base = os.path.expanduser('~/Library/Application Support')
+    else:
+        base = os.environ.get('XDG_DATA_HOME') or os.path.expanduser('~/.local/share')
+    return os.path.join(base, SOFTWARE_NAME)
 
 
 class BaseSettingsGroup(object):
     def __init__(self):
         self._settings = Settings()         # type: Settings
 
+    def _key(self, value_name):
+        # A prefix rather than beginGroup/endGroup, which would change the group for every thread at once.
+        return '{}/{}'.format(type(self).__name__, value_name)
+
     def value(self, value_name, default=None):
-        self._settings.beginGroup(type(self).__name__)
-        value = self._settings.value(value_name, default)
-        self._settings.endGroup()
-        return value
+        return self._settings.value(self._key(value_name), default)
 
     def set_value(self, value_name, value):
-        self._settings.beginGroup(type(self).__name__)
-        self._settings.setValue(value_name, value)
-        self._settings.endGroup()
+        self._settings.setValue(self._key(value_name), value)
         
         
 class _ModeSettings(BaseSettingsGroup):
@@ -89,6 +221,78 @@ class ServerSettings(_ModeSettings):
     def server_port(self, value):
         self.set_value("server_port", value)
 
+    @property
+    def auto_click_schedules(self):
+        """
+        :return: The auto clicker's schedules, as ``AutoClickSchedule.to_dict`` returns them.
+        :rtype: list[dict]
+        """
+        return json.loads(self.value("auto_click_schedules", "[]"))
+
+    @auto_click_schedules.setter
+    def auto_click_schedules(self, value):
+        self.set_value("auto_click_schedules", json.dumps(value))
+
+
+class ServerSettingsSnapshot(namedtuple('ServerSettingsSnapshot', ('server_name', 'server_port', 'server_password'))):
+    """
+    An immutable copy of the server settings, for the server to read while serving without touching the settings file.
+
+    The copy is taken again when the settings file changes (once ``watch`` was called) or when ``reload`` is called,
+    e.g. right after the settings were saved. The file's modification time tells when it changed, which is why the
+    settings are always kept in a file (see ``Settings``); switching to another file counts as a change too.
+    """
+    __slots__ = ()
+    _current = None
+    _file_state = None  # type: tuple[str, float]
+    _lock = Lock()
+    _watcher = None  # type: Thread
+
+    @classmethod
+    def current(cls):
+        """
+        :rtype: ServerSettingsSnapshot
+        """
+        snapshot = cls._current
+        if snapshot is None:
+            snapshot = cls.reload()
+        return snapshot
+
+    @classmethod
+    def reload(cls):
+        """
+        :rtype: ServerSettingsSnapshot
+        """
+        with cls._lock:
+            # The watcher may have seen the change before Settings' own (throttled) check did.
+            Settings().reload_from_disk()
+            cls._file_state = cls._settings_file_state()
+            settings = ServerSettings()
+            cls._current = cls(settings.server_name, settings.server_port, settings.server_password)
+            return cls._current
+
+    @classmethod
+    def watch(cls, interval=SETTINGS_WATCH_INTERVAL):
+        """Reload whenever the settings file changes, checking every ``interval`` seconds in the background."""
+        with cls._lock:
+            if cls._watcher is not None:
+                return
+            cls._watcher = Thread(target=cls._watch, args=(interval, ), name='Server settings watcher')
+            cls._watcher.daemon = True
+            cls._watcher.start()
+
+    @classmethod
+    def _watch(cls, interval):
+        while True:
+            time.sleep(interval)
+            if cls._settings_file_state() != cls._file_state:
+                cls.reload()
+
+    @staticmethod
+    def _settings_file_state():
+        settings = Settings()
+        return settings.fileName(), settings.file_modification_time()
+
 
 class ClientSettings(_ModeSettings):
     @property
@@ -0,0 +1,119 @@
+import os
+import struct
+import time
+from threading import Lock
+
+
+class TemperatureLog(object):
+    """
+    An append-only file of temperature samples.
+
+    Each sample is a fixed-width record (a 32bit timestamp and a 32bit float), so any point in time can be found with a
+    binary search on the file and queries only read the records in their range, a chunk at a time.
+
+    Records are only ever added at the end, so a query reads the records that were there when it started through a
+    file of its own, without holding up the appends.
+    """
+    HEADER = struct.Struct('<4sI')
+    RECORD = struct.Struct('<If')
+    MAGIC = 'ICTL'
+    VERSION = 1
+    # Records read from the file at once while aggregating.
+    CHUNK_SIZE = 4096
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = Lock()
+        is_new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self._file = open(path, 'w+b' if is_new else 'r+b')
+        if is_new:
+            self._file.write(self.HEADER.pack(self.MAGIC, self.VERSION))
+            self._file.flush()
+        else:
+            try:
+                magic, version = self.HEADER.unpack(self._file.read(self.HEADER.size))
+            except struct.error:
+                # Cut off within the header.
+                magic = version = None
+            if magic != self.MAGIC or version != self.VERSION:
+                self._file.close()
+                raise IOError("{} isn't a temperature log".format(path))
+            # Drop a record that was cut off half way through.
+            self._file.truncate(self._offset(len(self)))
+        self._last_timestamp = self._read(len(self) - 1)[0] if len(self) else None
+
+    def __len__(self):
+        return (os.fstat(self._file.fileno()).st_size - self.HEADER.size) // self.RECORD.size
+
+    def _offset(self, index):
+        return self.HEADER.size + index * self.RECORD.size
+
+    def _read(self, index, log_file=None):
+        log_file = log_file or self._file
+        log_file.seek(self._offset(index))
+        return self.RECORD.unpack(log_file.read(self.RECORD.size))
+
+    def _bisect(self, log_file, count, timestamp):
+        """The index of the first of the first ``count`` records that's at or after the given time."""
+        low, high = 0, count
+        while low < high:
+            middle = (low + high) // 2
+            if self._read(middle, log_file)[0] < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def append(self, temperature, timestamp=None):
+        timestamp = int(timestamp if timestamp is not None else time.time())
+        with self._lock:
+            if self._last_timestamp is not None and timestamp < self._last_timestamp:
+                # The clock went back, the records must stay sorted for the binary search.
+                return
+            self._file.seek(0, os.SEEK_END)
+            self._file.write(self.RECORD.pack(timestamp, temperature))
+            self._file.flush()
+            self._last_timestamp = timestamp
+
+    def query(self, start=None, end=None, buckets=100):
+        """
+        Summarize the samples taken in [start, end) into equal time buckets.
+
+        :return: A (bucket start time, minimum, average, maximum, samples count) tuple for each bucket with samples.
+        :rtype: list[tuple]
+        """
+        with self._lock:
+            count, last_timestamp = len(self), self._last_timestamp
+        if not count:
+            return []
+        with open(self.path, 'rb') as log_file:
+            start = int(start if start is not None else self._read(0, log_file)[0])
+            end = int(end if end is not None else last_timestamp + 1)
+            if end <= start:
+                return []
+            buckets = max(1, min(int(buckets), end - start))
+            bucket_length = float(end - start) / buckets
+            summaries = {}
+            index, last_index = self._bisect(log_file, count, start), self._bisect(log_file, count, end)
+            while index < last_index:
+                chunk_count = min(self.CHUNK_SIZE, last_index - index)
+                log_file.seek(self._offset(index))
+                data = log_file.read(chunk_count * self.RECORD.size)
+                for offset in xrange(0, len(data), self.RECORD.size):
+                    timestamp, temperature = self.RECORD.unpack_from(data, offset)
+                    bucket = int((timestamp - start) / bucket_length)
+                    summary = summaries.get(bucket)
+                    if summary is None:
+                        summaries[bucket] = [temperature, temperature, temperature, 1]
+                    else:
+                        summary[0] = min(summary[0], temperature)
+                        summary[1] += temperature
+                        summary[2] = max(summary[2], temperature)
+                        summary[3] += 1
+                index += chunk_count
+        return [(start + bucket * bucket_length, minimum, total / samples, maximum, samples)
+                for bucket, (minimum, total, maximum, samples) in sorted(summaries.items())]
+
+    def close(self):
+        with self._lock:
+            self._file.close()
@@ -0,0 +1,172 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+from Queue import Queue
+from threading import Thread
+
+from async_server import AsyncMainServer
+from client import Client, BadPasswordException, RequestFailedException, timeout
+from consts import *
+from futures import Future
+from schedules import AutoClickSchedule, DEFAULT_SCHEDULE_ID
+from serial_api import Clicker
+from serial_api.simulator import VirtualClicker
+from server import MainServer, PoolMainServer
+from settings import Settings, ServerSettings, ServerSettingsSnapshot
+
+SERVER_NAME = 'Test server'
+PASSWORD = 'secret'
+
+
+@unittest.skipIf(sys.platform == 'win32', 'The virtual clicker needs a pseudo-terminal')
+class ClientServerTest(unittest.TestCase):
+    """Round trips between a client and a password protected server, clicking a virtual clicker."""
+    SERVER_CLASS = MainServer
+
+    def setUp(self):
+        self.virtual_clicker = VirtualClicker(move_delay=0)
+        self._original_clicker = Clicker._instances.get(None)
+        # The server's clicker, instead of looking for a real one.
+        Clicker._instances[None] = Clicker(self.virtual_clicker.port)
+        # Settings (and the temperature log next to them) of their own, rather than the user's.
+        self.directory = tempfile.mkdtemp()
+        Settings.use_file(os.path.join(self.directory, 'settings.ini'))
+        server_settings = ServerSettings()
+        server_settings.server_name = SERVER_NAME
+        server_settings.server_password = PASSWORD
+        ServerSettingsSnapshot.reload()
+        self.server = self._start_server()
+        self.client = self._client(PASSWORD)
+
+    def tearDown(self):
+        self.client.close()
+        self._stop_server()
+        self.virtual_clicker.close()
+        if self._original_clicker is None:
+            Clicker._instances.pop(None, None)
+        else:
+            Clicker._instances[None] = self._original_clicker
+        Settings.use_file(None)
+        ServerSettingsSnapshot._current = None
+        shutil.rmtree(self.directory)
+
+    def _start_server(self):
+        server = self.SERVER_CLASS(SERVER_NAME, ('127.0.0.1', 0))
+        thread = Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return server
+
+    def _stop_server(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _client(self, password):
+        return Client('127.0.0.1', self.server.server_address[1], password=password, client_name='tester', timeout=5)
+
+    def test_requests_with_a_token(self):
+        # The first request goes through the challenge, the ones after it present the token it got.
+        self.client.send(CODE_START_COMM)
+        self.assertEqual(self.client.send_receive(CODE_SAY_HELLO)[1]['message'], 'Hello from ' + SERVER_NAME)
+        self.client.send(CODE_START_COMM)
+        self.assertIn('temperature', self.client.send_receive(CODE_GET_TEMPERATURE)[1])
+
+    def test_wrong_password(self):
+        self.assertRaises(BadPasswordException, self._client('wrong').server_info)
+
+    def test_click(self):
+        self.client.click()
+        self.assertIsNotNone(self.server.last_click_time)
+        self.assertGreater(self.client.clicker_stats()['counters'].get('commands:8', 0), 0)
+
+    def test_click_restarts_only_the_auto_clicker(self):
+        self.server.set_auto_clicker(10)
+        self.server.set_auto_click_schedule(AutoClickSchedule('hourly', interval=60, start_time=time.time() - 600))
+        saved_schedules = ServerSettings().auto_click_schedules
+        start_times = dict((schedule_id, schedule.start_time)
+                           for schedule_id, schedule in self.server.auto_click_schedules.iteritems())
+        time.sleep(0.01)
+        self.client.click()
+        self.assertGreater(self.server.auto_click_schedules[DEFAULT_SCHEDULE_ID].start_time,
+                           start_times[DEFAULT_SCHEDULE_ID])
+        self.assertEqual(self.server.auto_click_schedules['hourly'].start_time, start_times['hourly'])
+        # Clicks don't write the settings.
+        self.assertEqual(ServerSettings().auto_click_schedules, saved_schedules)
+
+    def test_bad_schedule(self):
+        self.assertRaises(RequestFailedException, self.client.set_auto_click_schedule, cron='bogus')
+        self.assertRaises(RequestFailedException, self.client.set_auto_click_schedule, cron=5)
+        self.assertRaises(RequestFailedException, self.client.send_receive, CODE_SET_AUTO_CLICK_SCHEDULE,
+                          schedule='bogus')
+        self.client.open_session()
+        self.assertRaises(RequestFailedException, self.client.set_auto_click_schedule, interval=-1)
+        self.assertEqual(self.server.auto_click_schedules, {})
+
+    def test_corrupt_saved_schedules(self):
+        self._stop_server()
+        ServerSettings().set_value('auto_click_schedules', '{not json')
+        self.server = self._start_server()
+        self.assertEqual(self.server.auto_click_schedules, {})
+
+    def test_temperature(self):
+        deadline = time.time() + 5
+        while self.client.get_temperature() is None and time.time() < deadline:
+            time.sleep(0.1)
+        self.assertEqual(self.client.get_temperature(), self.virtual_clicker.temperature)
+
+    def test_session(self):
+        self.client.open_session()
+        futures = self.client.pipeline(dict(code=CODE_SAY_HELLO), dict(code=CODE_GET_SERVER_INFO))
+        self.assertEqual(futures[0].result()[1]['message'], 'Hello from ' + SERVER_NAME)
+        self.assertIn('auto_click_schedules', futures[1].result()[1])
+
+    def test_session_events(self):
+        events = Queue()
+        self.client.event_handlers = {CODE_SHOW_NOTIFICATION: lambda **data: events.put(data['message'])}
+        self.client.connect()
+        # Whatever the server does once the session's requests were answered must not drop the subscription.
+        time.sleep(0.2)
+        self.assertEqual(len(self.server.session_subscribers), 1)
+        self.server.push(CODE_SHOW_NOTIFICATION, title='Test', message='Hello')
+        self.assertEqual(events.get(timeout=5), 'Hello')
+
+    def test_events_within_the_push_window(self):
+        notifications = Queue()
+
+        def push(subscribers, events):
+            notifications.put([kwargs['message'] for code, kwargs in events if code == CODE_SHOW_NOTIFICATION])
+        self.server.push_dispatcher.push = push
+        self.server.push_window = 0.2
+        for message in ('1', '2', '3'):
+            self.server.push(CODE_SHOW_NOTIFICATION, title='Test', message=message)
+        self.assertEqual(notifications.get(timeout=5), ['1', '2', '3'])
+        time.sleep(0.3)
+        self.server.push(CODE_SHOW_NOTIFICATION, title='Test', message='4')
+        self.assertEqual(notifications.get(timeout=5), ['4'])
+
+    def test_unanswered_session_request(self):
+        # A click that never finishes, the server never answers.
+        self.server.click = lambda is_auto_click=False: Future()
+        client = self._client(PASSWORD)
+        client.timeout = 0.2
+        client.open_session()
+        self.assertRaises(timeout, client.click)
+        self.assertFalse(client.is_session_open())
+        client.close()
+
+
+class PoolClientServerTest(ClientServerTest):
+    """The same round trips, with the worker pool engine."""
+    SERVER_CLASS = PoolMainServer
+
+
+class AsyncClientServerTest(ClientServerTest):
+    """The same round trips, with the event loop engine."""
+    SERVER_CLASS = AsyncMainServer
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,34 @@
+import unittest
+from threading import Timer
+
+from futures import Future, TimeoutError
+
+
+class FutureTest(unittest.TestCase):
+    def test_result(self):
+        future = Future()
+        Timer(0.05, future.set_result, args=(3, )).start()
+        self.assertEqual(future.result(5), 3)
+
+    def test_exception(self):
+        future = Future()
+        future.set_exception((KeyError, KeyError('missing'), None))
+        self.assertRaises(KeyError, future.result)
+
+    def test_timeout(self):
+        future = Future()
+        self.assertRaises(TimeoutError, future.result, 0.05)
+        future.set_result(None)
+        self.assertIsNone(future.result(0))
+
+    def test_done_callback(self):
+        future = Future()
+        results = []
+        future.add_done_callback(lambda done: results.append(done.result()))
+        future.set_result(1)
+        future.add_done_callback(lambda done: results.append(done.result() + 1))
+        self.assertEqual(results, [1, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()
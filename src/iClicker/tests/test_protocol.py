@@ -0,0 +1,100 @@
+import json
+import unittest
+
+from protocol import MessageReader, ProtocolError, HEADER, MAX_MESSAGE_SIZE, CODEC_BINARY, CODEC_JSON, \
+    encode_message, negotiate_codec
+
+
+class ChunkedSocket(object):
+    """Hands out the given chunks of bytes, one per ``recv_into``, the way TCP may split them. Then it's closed."""
+    def __init__(self, *chunks):
+        self.chunks = list(chunks)
+        self.recv_count = 0
+
+    def recv_into(self, buffer):
+        self.recv_count += 1
+        if not self.chunks:
+            return 0
+        chunk = self.chunks.pop(0)
+        if len(chunk) > len(buffer):
+            # The rest stays for the next recv.
+            chunk, rest = chunk[:len(buffer)], chunk[len(buffer):]
+            self.chunks.insert(0, rest)
+        buffer[:len(chunk)] = chunk
+        return len(chunk)
+
+
+class NegotiateCodecTest(unittest.TestCase):
+    def test_prefers_binary(self):
+        self.assertEqual(negotiate_codec([CODEC_JSON, CODEC_BINARY]), CODEC_BINARY)
+
+    def test_falls_back_to_json(self):
+        self.assertEqual(negotiate_codec(None), CODEC_JSON)
+        self.assertEqual(negotiate_codec(['msgpack']), CODEC_JSON)
+
+
+class MessageReaderTest(unittest.TestCase):
+    def test_json_message(self):
+        message = dict(code=3, name='server', temperature=25.5)
+        reader = MessageReader(ChunkedSocket(encode_message(message)))
+        self.assertEqual(reader.read(), message)
+        self.assertIsNone(reader.read())
+
+    def test_binary_messages_take_the_name_from_the_first_json_one(self):
+        data = encode_message(dict(code=3, name='server')) + encode_message(dict(code=12, x=1), CODEC_BINARY) + \
+            encode_message(dict(code=13), CODEC_BINARY)
+        reader = MessageReader(ChunkedSocket(data))
+        self.assertEqual(reader.read(), dict(code=3, name='server'))
+        self.assertEqual(reader.read(), dict(code=12, name='server', x=1))
+        self.assertEqual(reader.read(), dict(code=13, name='server'))
+
+    def test_message_split_byte_by_byte(self):
+        message = dict(code=7, name='client', events=range(20))
+        data = encode_message(message)
+        reader = MessageReader(ChunkedSocket(*data))
+        self.assertEqual(reader.read(), message)
+        self.assertIsNone(reader.read())
+
+    def test_several_messages_in_a_single_recv(self):
+        messages = [dict(code=code, request_id=code) for code in xrange(1, 6)]
+        sock = ChunkedSocket(''.join(encode_message(message) for message in messages))
+        reader = MessageReader(sock)
+        self.assertEqual([reader.read() for _ in messages], messages)
+        self.assertEqual(sock.recv_count, 1)
+
+    def test_message_split_across_messages(self):
+        data = encode_message(dict(code=1, text='a' * 10)) + encode_message(dict(code=2, text='b' * 10))
+        middle = len(data) // 2
+        reader = MessageReader(ChunkedSocket(data[:middle], data[middle:]))
+        self.assertEqual(reader.read()['code'], 1)
+        self.assertEqual(reader.read()['code'], 2)
+
+    def test_message_larger_than_the_buffer(self):
+        message = dict(code=1, text='x' * 1000)
+        reader = MessageReader(ChunkedSocket(encode_message(message), encode_message(dict(code=2))), buffer_size=8)
+        self.assertEqual(reader.read(), message)
+        self.assertEqual(reader.read(), dict(code=2))
+
+    def test_read_buffered_doesnt_receive(self):
+        data = encode_message(dict(code=1))
+        sock = ChunkedSocket(data[:3], data[3:])
+        reader = MessageReader(sock)
+        self.assertIsNone(reader.read_buffered())
+        self.assertEqual(sock.recv_count, 0)
+        self.assertEqual(reader.fill(), 3)
+        self.assertIsNone(reader.read_buffered())
+        reader.fill()
+        self.assertEqual(reader.read_buffered(), dict(code=1))
+
+    def test_closed_in_the_middle_of_a_message(self):
+        data = encode_message(dict(code=1, text='cut'))
+        reader = MessageReader(ChunkedSocket(data[:-2]))
+        self.assertRaises(ProtocolError, reader.read)
+
+    def test_too_long_message(self):
+        reader = MessageReader(ChunkedSocket(HEADER.pack(MAX_MESSAGE_SIZE + 1) + json.dumps(dict(code=1))))
+        self.assertRaises(ProtocolError, reader.read)
+
+
+if __name__ == '__main__':
+    unittest.main()
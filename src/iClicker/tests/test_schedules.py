@@ -0,0 +1,103 @@
+import datetime
+import time
+import unittest
+
+from schedules import CronRule, AutoClickSchedule, SCHEDULE_CRON, SCHEDULE_INTERVAL
+
+
+def timestamp(*args):
+    """The (local) timestamp of the given date and time."""
+    return time.mktime(datetime.datetime(*args).timetuple())
+
+
+class CronRuleTest(unittest.TestCase):
+    def test_fields(self):
+        rule = CronRule('*/15 9-17/4 1,15 * 1-5')
+        self.assertEqual(rule.minutes, [0, 15, 30, 45])
+        self.assertEqual(rule.hours, [9, 13, 17])
+        self.assertEqual(rule.days, [1, 15])
+        self.assertEqual(rule.months, range(1, 13))
+        self.assertEqual(rule.weekdays, set([1, 2, 3, 4, 5]))
+
+    def test_sunday_is_0_and_7(self):
+        self.assertEqual(CronRule('0 0 * * 7').weekdays, set([0]))
+
+    def test_bad_rules(self):
+        for rule in ('* * * *', '60 * * * *', '* 24 * * *', '* * 0 * *', '5-1 * * * *', '*/0 * * * *', 'a * * * *'):
+            self.assertRaises(ValueError, CronRule, rule)
+
+    def test_next_minute(self):
+        # A second into a minute, the next match is the next minute, not this one.
+        self.assertEqual(CronRule('* * * * *').next_time(timestamp(2026, 3, 11, 10, 20, 1)),
+                         timestamp(2026, 3, 11, 10, 21))
+
+    def test_daily(self):
+        rule = CronRule('0 7 * * *')
+        self.assertEqual(rule.next_time(timestamp(2026, 3, 11, 6, 59)), timestamp(2026, 3, 11, 7, 0))
+        self.assertEqual(rule.next_time(timestamp(2026, 3, 11, 7, 0)), timestamp(2026, 3, 12, 7, 0))
+
+    def test_work_hours(self):
+        rule = CronRule('*/10 9-17 * * 1-5')
+        # Wednesday during work hours.
+        self.assertEqual(rule.next_time(timestamp(2026, 3, 11, 12, 34)), timestamp(2026, 3, 11, 12, 40))
+        # Friday evening, the next one is on Monday morning.
+        self.assertEqual(rule.next_time(timestamp(2026, 3, 13, 17, 55)), timestamp(2026, 3, 16, 9, 0))
+
+    def test_day_of_month_or_day_of_week(self):
+        # The 1st of the month or any Sunday, whichever comes first. 2026-03-11 is a Wednesday.
+        rule = CronRule('30 12 1 * 0')
+        self.assertEqual(rule.next_time(timestamp(2026, 3, 11)), timestamp(2026, 3, 15, 12, 30))
+        self.assertEqual(rule.next_time(timestamp(2026, 3, 29, 13)), timestamp(2026, 4, 1, 12, 30))
+
+    def test_leap_day(self):
+        self.assertEqual(CronRule('0 0 29 2 *').next_time(timestamp(2026, 3, 11)), timestamp(2028, 2, 29))
+
+    def test_never_matches(self):
+        self.assertRaises(ValueError, CronRule('0 0 30 2 *').next_time, timestamp(2026, 3, 11))
+
+
+class AutoClickScheduleTest(unittest.TestCase):
+    def test_interval_counts_from_the_start_time(self):
+        start = timestamp(2026, 3, 11, 10)
+        schedule = AutoClickSchedule(interval=10, start_time=start)
+        self.assertEqual(schedule.kind, SCHEDULE_INTERVAL)
+        self.assertEqual(schedule.next_fire_time(start), start + 600)
+        self.assertEqual(schedule.next_fire_time(start + 601), start + 1200)
+        # Exactly at a fire time, the next one is an interval later.
+        self.assertEqual(schedule.next_fire_time(start + 1200), start + 1800)
+
+    def test_cron(self):
+        schedule = AutoClickSchedule(cron='0 7 * * *')
+        self.assertEqual(schedule.kind, SCHEDULE_CRON)
+        self.assertEqual(schedule.next_fire_time(timestamp(2026, 3, 11, 8)), timestamp(2026, 3, 12, 7))
+
+    def test_disabled(self):
+        self.assertIsNone(AutoClickSchedule(interval=5, is_enabled=False).next_fire_time())
+
+    def test_bad_schedules(self):
+        self.assertRaises(ValueError, AutoClickSchedule)
+        self.assertRaises(ValueError, AutoClickSchedule, interval=5, cron='* * * * *')
+        self.assertRaises(ValueError, AutoClickSchedule, interval=0)
+        self.assertRaises(ValueError, AutoClickSchedule, interval=1.5)
+        self.assertRaises(ValueError, AutoClickSchedule, cron='0 0 30 2 *')
+        self.assertRaises(ValueError, AutoClickSchedule, interval=True)
+        self.assertRaises(ValueError, AutoClickSchedule, cron=5)
+        self.assertRaises(ValueError, AutoClickSchedule, ['id'], interval=5)
+        self.assertRaises(ValueError, AutoClickSchedule, interval=5, start_time='now')
+
+    def test_bad_dicts(self):
+        for data in ('bogus', None, [], dict(cron=['*']), dict(interval='5')):
+            self.assertRaises(ValueError, AutoClickSchedule.from_dict, data)
+
+    def test_dict_round_trip(self):
+        schedule = AutoClickSchedule('work', cron='*/10 9-17 * * 1-5', is_enabled=False, start_time=1000)
+        copy = AutoClickSchedule.from_dict(schedule.to_dict())
+        self.assertEqual(copy.to_dict(), schedule.to_dict())
+        self.assertEqual(copy.schedule_id, 'work')
+
+    def test_generated_ids(self):
+        self.assertNotEqual(AutoClickSchedule(interval=1).schedule_id, AutoClickSchedule(interval=1).schedule_id)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,278 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+from collections import namedtuple
+from threading import Event
+
+import serial_api
+from serial_api import Clicker, ClickerState, VID, PID, CODE_GET_CLICK_POS, CODE_GET_TEMPERATURE, CODE_MOVE_CLICKER, \
+    PRIORITY_CLICK, PRIORITY_CALIBRATION, PRIORITY_TEMPERATURE, NoClickerError
+
+try:
+    from serial_api.simulator import VirtualClicker
+except ImportError:
+    # No pseudo-terminals on Windows.
+    VirtualClicker = None
+
+
+@unittest.skipIf(VirtualClicker is None or sys.platform == 'win32', 'The virtual clicker needs a pseudo-terminal')
+class VirtualClickerTestCase(unittest.TestCase):
+    """
+    A ``Clicker`` talking to a fresh virtual clicker, with short timeouts. With ``LINK``, it's reached through a link
+    that stays the same across unplugging and plugging it.
+    """
+    READ_TIMEOUT = 0.3
+    SERVO_MOVE_TIME = 0.05
+    # serial_api's settings changed for the test.
+    SETTINGS = dict(READ_TIMEOUT=READ_TIMEOUT, SERVO_MOVE_TIME=SERVO_MOVE_TIME)
+    LINK = False
+
+    def setUp(self):
+        self._original_settings = dict((name, getattr(serial_api, name)) for name in self.SETTINGS)
+        for name, value in self.SETTINGS.iteritems():
+            setattr(serial_api, name, value)
+        self.directory = tempfile.mkdtemp()
+        link = os.path.join(self.directory, 'clicker') if self.LINK else None
+        self.virtual_clicker = VirtualClicker(move_delay=self.SERVO_MOVE_TIME, temperature=42.0, link=link)
+        self.port = link or self.virtual_clicker.port
+        self.clicker = Clicker(self.port)
+
+    def tearDown(self):
+        self.clicker.close()
+        self.virtual_clicker.close()
+        # Pseudo-terminal names are reused, the next test must get a Clicker of its own.
+        Clicker._instances.pop(self.port, None)
+        for name, value in self._original_settings.iteritems():
+            setattr(serial_api, name, value)
+        shutil.rmtree(self.directory)
+
+    def counter(self, name):
+        return self.clicker.stats.snapshot()['counters'].get(name, 0)
+
+
+class SessionTest(VirtualClickerTestCase):
+    def test_one_session_for_all_the_commands(self):
+        for _ in xrange(5):
+            self.assertEqual(self.clicker.temperature, 42.0)
+        self.clicker.click()
+        self.assertEqual(self.clicker.stats.snapshot()['latencies']['open']['count'], 1)
+
+    def test_reply_after_queued_clicks(self):
+        # The clicks take longer than the read timeout, the reply waits for them.
+        for _ in xrange(5):
+            self.clicker.click()
+        self.assertEqual(self.clicker.temperature, 42.0)
+        self.assertEqual(self.clicker.click_pos, 120)
+
+    def test_idle_time(self):
+        self.assertEqual(self.clicker.seconds_until_idle(), 0)
+        start_time = time.time()
+        for _ in xrange(3):
+            self.clicker.click()
+        # Two moves a click.
+        self.assertAlmostEqual(self.clicker.idle_time(), start_time + 6 * self.SERVO_MOVE_TIME, places=1)
+
+    def test_late_reply_is_skipped(self):
+        self.virtual_clicker.latency = self.READ_TIMEOUT * 1.5
+        self.assertRaises(Exception, lambda: self.clicker.temperature)
+        self.virtual_clicker.latency = 0
+        # The late temperature isn't taken as the positions' reply, nor are the replies a step behind from now on.
+        self.assertEqual(self.clicker.refresh_positions(), {1: 120, 3: 90, 5: 255})
+        self.assertEqual(self.clicker.temperature, 42.0)
+        self.assertEqual(self.counter('skipped_replies'), 1)
+
+    def test_lost_reply(self):
+        self.virtual_clicker.failure_rate = 1
+        self.assertRaises(Exception, lambda: self.clicker.temperature)
+        self.virtual_clicker.failure_rate = 0
+        self.assertEqual(self.clicker.temperature, 42.0)
+        self.assertEqual(self.counter('skipped_replies'), 0)
+
+
+class DisconnectTest(VirtualClickerTestCase):
+    SETTINGS = dict(VirtualClickerTestCase.SETTINGS, OPEN_RETRY_DELAY=0.01, PROBE_MIN_DELAY=0.05)
+    LINK = True
+
+    def unplug(self):
+        self.assertEqual(self.clicker.temperature, 42.0)
+        self.virtual_clicker.unplug()
+        self.assertRaises(NoClickerError, self.clicker.click)
+
+    def wait_until_connected(self):
+        deadline = time.time() + 5
+        while not self.clicker.is_connected() and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(self.clicker.is_connected())
+
+    def test_fail_fast(self):
+        self.unplug()
+        self.assertFalse(self.clicker.is_connected())
+        start_time = time.time()
+        self.assertRaises(NoClickerError, self.clicker.click)
+        self.assertLess(time.time() - start_time, serial_api.OPEN_RETRY_DELAY)
+        self.assertEqual(self.counter('rejected_while_disconnected'), 1)
+
+    def test_reconnect(self):
+        self.unplug()
+        self.virtual_clicker.plug()
+        self.wait_until_connected()
+        self.assertEqual(self.clicker.temperature, 42.0)
+
+    def test_probe_survives_errors(self):
+        self.unplug()
+        connect = self.clicker._connect
+        failures = []
+
+        def failing_connect(port):
+            if not failures:
+                failures.append(port)
+                raise OSError('Not ready')
+            return connect(port)
+        self.clicker._connect = failing_connect
+        self.virtual_clicker.plug()
+        self.wait_until_connected()
+        self.assertTrue(failures)
+        self.assertEqual(self.clicker.temperature, 42.0)
+
+
+class BatchTest(VirtualClickerTestCase):
+    def test_replies_in_order(self):
+        replies = self.clicker.batch(CODE_GET_CLICK_POS, (CODE_MOVE_CLICKER, 45), CODE_GET_TEMPERATURE)
+        self.assertEqual(replies, [120, None, 42.0])
+        self.assertEqual(self.virtual_clicker.servo_pos, 45)
+
+    def test_one_write(self):
+        self.clicker.batch(CODE_GET_CLICK_POS, (CODE_MOVE_CLICKER, 45), CODE_GET_TEMPERATURE)
+        stats = self.clicker.stats.snapshot()
+        self.assertEqual(stats['latencies']['write:batch']['count'], 1)
+        self.assertEqual(stats['counters']['commands:{}'.format(CODE_MOVE_CLICKER)], 1)
+
+    def test_read_state(self):
+        self.assertEqual(self.clicker.read_state(), ClickerState(120, 255, 90, 42.0))
+
+
+class PositionsMirrorTest(VirtualClickerTestCase):
+    def reads(self):
+        return self.counter('commands:{}'.format(CODE_GET_CLICK_POS))
+
+    def test_read_once(self):
+        self.assertEqual(self.clicker.click_pos, 120)
+        self.assertEqual(self.clicker.released_pos, 90)
+        self.assertEqual(self.clicker.click_pos, 120)
+        self.assertEqual(self.reads(), 1)
+
+    def test_write_through(self):
+        self.clicker.click_pos = 100
+        self.assertEqual(self.clicker.click_pos, 100)
+        # A reply comes after the clicker handled the commands before it.
+        self.clicker.temperature
+        self.assertEqual(self.virtual_clicker.eeprom[CODE_GET_CLICK_POS], 100)
+        self.assertEqual(self.reads(), 0)
+
+    def test_rejected_angle_isnt_mirrored(self):
+        self.assertEqual(self.clicker.click_pos, 120)
+        self.clicker.click_pos = 200
+        self.assertEqual(self.clicker.click_pos, 120)
+        self.clicker.disable_click2()
+        self.assertFalse(self.clicker.is_click2_enabled())
+
+    def test_changes_behind_the_clickers_back(self):
+        self.assertEqual(self.clicker.click_pos, 120)
+        self.virtual_clicker.eeprom[CODE_GET_CLICK_POS] = 130
+        self.assertEqual(self.clicker.click_pos, 120)
+        self.clicker.invalidate_positions()
+        self.assertEqual(self.clicker.click_pos, 130)
+        self.virtual_clicker.eeprom[CODE_GET_CLICK_POS] = 140
+        self.assertEqual(self.clicker.refresh_positions()[CODE_GET_CLICK_POS], 140)
+        self.assertEqual(self.clicker.click_pos, 140)
+
+
+class WorkerTest(unittest.TestCase):
+    def setUp(self):
+        # The worker never touches the port unless a job does.
+        self.clicker = Clicker('worker test')
+
+    def tearDown(self):
+        Clicker._instances.pop('worker test', None)
+
+    def test_priorities(self):
+        release = Event()
+        self.clicker.submit(PRIORITY_CLICK, release.wait)
+        order = []
+        futures = [self.clicker.submit(priority, order.append, name) for priority, name in (
+            (PRIORITY_TEMPERATURE, 'temperature'), (PRIORITY_CALIBRATION, 'calibration'),
+            (PRIORITY_CLICK, 'click 1'), (PRIORITY_CLICK, 'click 2'))]
+        release.set()
+        for future in futures:
+            future.result(5)
+        self.assertEqual(order, ['click 1', 'click 2', 'calibration', 'temperature'])
+
+    def test_nested_job_runs_right_away(self):
+        def job():
+            return self.clicker.submit(PRIORITY_TEMPERATURE, lambda: 'nested').result(5)
+        self.assertEqual(self.clicker.submit(PRIORITY_CLICK, job).result(5), 'nested')
+
+    def test_exception(self):
+        self.assertRaises(ZeroDivisionError, self.clicker.submit(PRIORITY_CLICK, lambda: 1 / 0).result, 5)
+        self.assertEqual(self.clicker.stats.snapshot()['latencies']['queue']['count'], 1)
+
+
+FakePort = namedtuple('FakePort', ('device', 'vid', 'pid'))
+
+
+class PortCacheTest(unittest.TestCase):
+    def setUp(self):
+        import serial.tools.list_ports
+        self.list_ports = serial.tools.list_ports
+        self._originals = serial_api._serial_devices_signature, self.list_ports.comports
+        self.signature = frozenset(['ttyACM0'])
+        self.ports = [FakePort('/dev/ttyS0', 0, 0), FakePort('/dev/ttyACM0', VID, PID)]
+        self.scans = 0
+        serial_api._serial_devices_signature = lambda: self.signature
+        self.list_ports.comports = self._comports
+        Clicker.invalidate_port_cache()
+
+    def tearDown(self):
+        serial_api._serial_devices_signature, self.list_ports.comports = self._originals
+        Clicker.invalidate_port_cache()
+
+    def _comports(self):
+        self.scans += 1
+        return list(self.ports)
+
+    def test_cached_while_the_devices_stay(self):
+        self.assertEqual(Clicker.find_clicker_port(), '/dev/ttyACM0')
+        self.assertEqual(Clicker.find_clicker_port(), '/dev/ttyACM0')
+        self.assertEqual(self.scans, 1)
+
+    def test_devices_changed(self):
+        Clicker.find_clicker_port()
+        self.signature = frozenset(['ttyACM1'])
+        self.ports = [FakePort('/dev/ttyACM1', VID, PID)]
+        self.assertEqual(Clicker.find_clicker_port(), '/dev/ttyACM1')
+        self.assertEqual(self.scans, 2)
+
+    def test_not_found_is_cached_too(self):
+        self.ports = []
+        self.assertIsNone(Clicker.find_clicker_port())
+        self.assertIsNone(Clicker.find_clicker_port())
+        self.assertEqual(self.scans, 1)
+
+    def test_invalidate(self):
+        Clicker.find_clicker_port()
+        Clicker.invalidate_port_cache()
+        Clicker.find_clicker_port()
+        self.assertEqual(self.scans, 2)
+
+    def test_no_signature_always_scans(self):
+        self.signature = None
+        Clicker.find_clicker_port()
+        Clicker.find_clicker_port()
+        self.assertEqual(self.scans, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,225 @@
+import time
+import unittest
+from Queue import Queue
+from threading import Event
+
+from consts import *
+from server import ClientRegistry, PushDispatcher, Scheduler
+
+
+class SchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = Scheduler()
+        self.scheduler.start()
+        self.runs = Queue()
+
+    def tearDown(self):
+        self.scheduler.stop()
+        self.scheduler.join(5)
+
+    def run_names(self, count):
+        return [self.runs.get(timeout=5) for _ in xrange(count)]
+
+    def test_order(self):
+        for delay, name in ((0.15, 'third'), (0.05, 'first'), (0.1, 'second')):
+            self.scheduler.schedule(delay, self.runs.put, name)
+        self.assertEqual(self.run_names(3), ['first', 'second', 'third'])
+
+    def test_same_deadline(self):
+        deadline = time.time() + 0.05
+        for name in ('first', 'second'):
+            self.scheduler.reschedule(self.scheduler.schedule(60, self.runs.put, name), deadline)
+        self.assertEqual(self.run_names(2), ['first', 'second'])
+
+    def test_reschedule(self):
+        task = self.scheduler.schedule(0.05, self.runs.put, 'moved')
+        self.scheduler.schedule(0.1, self.runs.put, 'stayed')
+        task.reschedule(0.2)
+        self.assertEqual(self.run_names(2), ['stayed', 'moved'])
+        # Runs once, the outdated deadline is skipped.
+        time.sleep(0.1)
+        self.assertTrue(self.runs.empty())
+
+    def test_reschedule_earlier(self):
+        task = self.scheduler.schedule(60, self.runs.put, 'task')
+        # Wakes the scheduler up, which was sleeping until the old deadline.
+        task.reschedule(0.05)
+        self.assertEqual(self.run_names(1), ['task'])
+
+    def test_cancel(self):
+        task = self.scheduler.schedule(0.05, self.runs.put, 'cancelled')
+        self.scheduler.schedule(0.1, self.runs.put, 'kept')
+        task.cancel()
+        self.assertIsNone(task.seconds_left())
+        self.assertEqual(self.run_names(1), ['kept'])
+        time.sleep(0.1)
+        self.assertTrue(self.runs.empty())
+
+    def test_run_again(self):
+        task = self.scheduler.schedule(0.05, self.runs.put, 'task')
+        self.assertEqual(self.run_names(1), ['task'])
+        self.assertIsNone(task.seconds_left())
+        task.reschedule(0.05)
+        self.assertEqual(self.run_names(1), ['task'])
+
+    def test_failing_task(self):
+        self.scheduler.schedule(0.05, lambda: 1 / 0)
+        self.scheduler.schedule(0.1, self.runs.put, 'after')
+        self.assertEqual(self.run_names(1), ['after'])
+
+
+class ClientRegistryTest(unittest.TestCase):
+    TIMEOUT = 0.2
+
+    def setUp(self):
+        self.registry = ClientRegistry(timeout=self.TIMEOUT)
+
+    def tearDown(self):
+        self.registry.stop()
+
+    def wait_until_empty(self):
+        deadline = time.time() + 5
+        while len(self.registry) and time.time() < deadline:
+            time.sleep(0.01)
+
+    def test_register(self):
+        self.registry.register('10.0.0.1', 1000)
+        self.registry.register('10.0.0.2', 2000)
+        self.registry.register('10.0.0.1', 1001)
+        self.assertEqual(self.registry.snapshot(), {'10.0.0.1': 1001, '10.0.0.2': 2000})
+
+    def test_expiry(self):
+        self.registry.register('10.0.0.1', 1000)
+        start_time = time.time()
+        self.wait_until_empty()
+        self.assertEqual(self.registry.snapshot(), {})
+        self.assertGreaterEqual(time.time() - start_time, self.TIMEOUT)
+
+    def test_renewal(self):
+        self.registry.register('10.0.0.1', 1000)
+        self.registry.register('10.0.0.2', 2000)
+        for _ in xrange(4):
+            time.sleep(self.TIMEOUT / 2)
+            self.registry.renew('10.0.0.1')
+        # Long after the first lease would have expired, only the client that wasn't renewed is gone.
+        self.assertEqual(self.registry.snapshot(), {'10.0.0.1': 1000})
+        self.wait_until_empty()
+        self.assertEqual(self.registry.snapshot(), {})
+
+    def test_renew_unknown_client(self):
+        self.registry.renew('10.0.0.1')
+        self.assertEqual(len(self.registry), 0)
+        self.assertEqual(self.registry._deadlines, [])
+
+    def test_outdated_deadlines_are_skipped(self):
+        self.registry.register('10.0.0.1', 1000)
+        for _ in xrange(3):
+            time.sleep(0.01)
+            self.registry.renew('10.0.0.1')
+        _, deadline = self.registry._leases['10.0.0.1']
+        with self.registry._lock:
+            # The older deadlines are due, the lease isn't.
+            self.assertEqual(self.registry._reap(deadline - 0.001), deadline)
+            self.assertEqual(self.registry._leases.keys(), ['10.0.0.1'])
+            self.assertIsNone(self.registry._reap(deadline))
+        self.assertEqual(self.registry.snapshot(), {})
+
+
+class RecordingPushDispatcher(PushDispatcher):
+    """Records the deliveries instead of making them. The deliveries to ``blocked`` wait for ``release``."""
+    def __init__(self):
+        super(RecordingPushDispatcher, self).__init__('Test server')
+        self.deliveries = Queue()
+        self.blocked = None
+        self.release = Event()
+        self.is_blocking = Event()
+
+    def _deliver(self, subscriber, code, kwargs):
+        if subscriber == self.blocked:
+            self.is_blocking.set()
+            self.release.wait(5)
+        self.deliveries.put((subscriber, code, kwargs))
+        return True
+
+
+def _event(index):
+    return CODE_SHOW_NOTIFICATION, dict(title='Test', message=str(index))
+
+
+def _messages(code, kwargs):
+    if code == CODE_EVENTS_BATCH:
+        return [event['message'] for event in kwargs['events']]
+    return [kwargs['message']]
+
+
+class PushDispatcherTest(unittest.TestCase):
+    def setUp(self):
+        self.dispatcher = RecordingPushDispatcher()
+
+    def tearDown(self):
+        self.dispatcher.release.set()
+        self.dispatcher.stop()
+
+    def messages_of(self, subscriber, count):
+        """The messages delivered to the subscriber, until there are ``count`` of them."""
+        messages = []
+        while len(messages) < count:
+            delivered_subscriber, code, kwargs = self.dispatcher.deliveries.get(timeout=5)
+            if delivered_subscriber == subscriber:
+                messages.extend(_messages(code, kwargs))
+        return messages
+
+    def test_every_subscriber(self):
+        self.dispatcher.push(['first', 'second'], [_event(0)])
+        deliveries = sorted(self.dispatcher.deliveries.get(timeout=5) for _ in xrange(2))
+        self.assertEqual(deliveries, [('first', ) + _event(0), ('second', ) + _event(0)])
+
+    def test_order_per_subscriber(self):
+        for index in xrange(50):
+            self.dispatcher.push(['subscriber'], [_event(index)])
+        self.assertEqual(self.messages_of('subscriber', 50), [str(index) for index in xrange(50)])
+
+    def test_batch(self):
+        self.dispatcher.blocked = 'subscriber'
+        self.dispatcher.push(['subscriber'], [_event(0)])
+        self.dispatcher.is_blocking.wait(5)
+        for index in xrange(1, 4):
+            self.dispatcher.push(['subscriber'], [_event(index)])
+        self.dispatcher.release.set()
+        self.assertEqual(self.dispatcher.deliveries.get(timeout=5), ('subscriber', ) + _event(0))
+        subscriber, code, kwargs = self.dispatcher.deliveries.get(timeout=5)
+        # What piled up meanwhile comes at once, in order.
+        self.assertEqual(code, CODE_EVENTS_BATCH)
+        self.assertEqual(_messages(code, kwargs), ['1', '2', '3'])
+        self.assertEqual(kwargs['events'][0]['code'], CODE_SHOW_NOTIFICATION)
+
+    def test_overflow_drops_the_oldest(self):
+        self.dispatcher.blocked = 'slow'
+        self.dispatcher.push(['slow'], [_event(0)])
+        self.dispatcher.is_blocking.wait(5)
+        for index in xrange(1, PUSH_QUEUE_SIZE + 11):
+            self.dispatcher.push(['slow'], [_event(index)])
+        # A slow subscriber doesn't hold up the others.
+        self.dispatcher.push(['fast'], [_event(0)])
+        self.assertEqual(self.messages_of('fast', 1), ['0'])
+        self.dispatcher.release.set()
+        self.assertEqual(self.messages_of('slow', PUSH_QUEUE_SIZE + 1),
+                         ['0'] + [str(index) for index in xrange(11, PUSH_QUEUE_SIZE + 11)])
+
+    def test_failed_subscriber_loses_its_queue(self):
+        dispatcher = self.dispatcher
+        dispatcher.blocked = 'failing'
+        deliver = dispatcher._deliver
+        dispatcher._deliver = lambda subscriber, code, kwargs: deliver(subscriber, code, kwargs) and False
+        dispatcher.push(['failing'], [_event(0)])
+        dispatcher.is_blocking.wait(5)
+        dispatcher.push(['failing'], [_event(1)])
+        dispatcher.release.set()
+        self.assertEqual(self.messages_of('failing', 1), ['0'])
+        dispatcher._deliver = deliver
+        dispatcher.push(['failing'], [_event(2)])
+        self.assertEqual(self.messages_of('failing', 1), ['2'])
+
+
+if __name__ == '__main__':
+    unittest.main()
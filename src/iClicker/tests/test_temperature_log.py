@@ -0,0 +1,96 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from temperature_log import TemperatureLog
+
+
+class TemperatureLogTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'temperature.log')
+        self.log = TemperatureLog(self.path)
+
+    def tearDown(self):
+        self.log.close()
+        shutil.rmtree(self.directory)
+
+    def test_empty(self):
+        self.assertEqual(len(self.log), 0)
+        self.assertEqual(self.log.query(), [])
+
+    def test_buckets(self):
+        for timestamp, temperature in ((100, 20.0), (101, 22.0), (105, 30.0), (109, 26.0), (110, 40.0)):
+            self.log.append(temperature, timestamp)
+        self.assertEqual(self.log.query(100, 110, buckets=2), [(100, 20.0, 21.0, 22.0, 2), (105, 26.0, 28.0, 30.0, 2)])
+
+    def test_buckets_without_samples_are_left_out(self):
+        self.log.append(10.0, 100)
+        self.log.append(20.0, 190)
+        self.assertEqual(self.log.query(100, 200, buckets=10), [(100, 10.0, 10.0, 10.0, 1), (190, 20.0, 20.0, 20.0, 1)])
+
+    def test_default_range_is_the_whole_log(self):
+        for timestamp in xrange(1000, 1100):
+            self.log.append(timestamp % 10, timestamp)
+        (start, minimum, average, maximum, samples), = self.log.query(buckets=1)
+        self.assertEqual((start, minimum, average, maximum, samples), (1000, 0, 4.5, 9, 100))
+
+    def test_range_is_half_open(self):
+        for timestamp in xrange(100, 110):
+            self.log.append(1.0, timestamp)
+        self.assertEqual(sum(bucket[4] for bucket in self.log.query(102, 105)), 3)
+        self.assertEqual(self.log.query(110, 120), [])
+        self.assertEqual(self.log.query(105, 105), [])
+
+    def test_more_buckets_than_seconds(self):
+        self.log.append(1.0, 100)
+        self.log.append(2.0, 101)
+        self.assertEqual(len(self.log.query(100, 102, buckets=100)), 2)
+
+    def test_older_samples_are_dropped(self):
+        self.log.append(1.0, 200)
+        self.log.append(2.0, 100)
+        self.assertEqual(len(self.log), 1)
+
+    def test_append_during_a_query(self):
+        for timestamp in xrange(100, 110):
+            self.log.append(1.0, timestamp)
+        bisect = self.log._bisect
+
+        def bisect_and_append(*args):
+            # The query must not hold the log while it reads, nor read past the records it started with.
+            self.log.append(2.0, 200)
+            return bisect(*args)
+        self.log._bisect = bisect_and_append
+        self.assertEqual(self.log.query(buckets=1), [(100, 1.0, 1.0, 1.0, 10)])
+        self.assertEqual(len(self.log), 12)
+
+    def test_reopen(self):
+        self.log.append(1.0, 100)
+        self.log.append(2.0, 101)
+        self.log.close()
+        # A record cut off half way through, as if the server died while writing it.
+        with open(self.path, 'ab') as log_file:
+            log_file.write('\x01\x02\x03')
+        self.log = TemperatureLog(self.path)
+        self.assertEqual(len(self.log), 2)
+        self.log.append(3.0, 102)
+        self.assertEqual(self.log.query(100, 103, buckets=1), [(100, 1.0, 2.0, 3.0, 3)])
+
+    def test_not_a_temperature_log(self):
+        other_path = os.path.join(self.directory, 'other')
+        with open(other_path, 'wb') as other_file:
+            other_file.write('something else')
+        self.assertRaises(IOError, TemperatureLog, other_path)
+
+    def test_cut_off_header(self):
+        self.log.close()
+        with open(self.path, 'r+b') as log_file:
+            log_file.truncate(TemperatureLog.HEADER.size - 1)
+        self.assertRaises(IOError, TemperatureLog, self.path)
+        self.log = TemperatureLog(os.path.join(self.directory, 'new.log'))
+
+
+if __name__ == '__main__':
+    unittest.main()